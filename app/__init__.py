@@ -1,15 +1,54 @@
+import logging
 from flask import Flask
 from app.config import load_configurations, configure_logging
-from .views import webhook_blueprint
 
 
 def create_app():
+    # Imported here rather than at module level: transcription workers are
+    # separate processes that import app.services.transcriber, and should not
+    # load the web stack (OpenAI client, scheduler, thread store) with it
+    from .views import webhook_blueprint, process_user_batch, notify_batch_failure
+    from .services.webhook_queue import WebhookQueue, UserDispatcher
+    from .services.dedup import MessageDeduplicator
+    from .services.openai_service import sync_assistant
+    from .services.scheduler import start_scheduler
+
     app = Flask(__name__)
 
     # Load configurations and logging settings
     load_configurations(app)
     configure_logging()
 
+    # Background pool that drains webhook events in async ingestion mode
+    app.extensions["webhook_queue"] = WebhookQueue(
+        app,
+        workers=app.config["WEBHOOK_WORKERS"],
+        maxsize=app.config["WEBHOOK_QUEUE_SIZE"],
+    )
+    # Per-user ordering on top of the pool; different users still run in parallel
+    app.extensions["user_dispatcher"] = UserDispatcher(
+        app.extensions["webhook_queue"],
+        process_user_batch,
+        coalesce=app.config["WEBHOOK_COALESCE"],
+        on_failure=notify_batch_failure,
+    )
+    # Message IDs already handled, shared by all workers, so Meta retries are only acknowledged
+    app.extensions["dedup"] = MessageDeduplicator(
+        app.config["DEDUP_CACHE_DIR"],
+        ttl=app.config["DEDUP_TTL"],
+        in_progress_ttl=app.config["DEDUP_IN_PROGRESS_TTL"],
+    )
+
+    # Runs reference the assistant by ID: make sure it has our current prompt and tools
+    if app.config["OPENAI_SYNC_ASSISTANT"]:
+        try:
+            sync_assistant()
+        except Exception:
+            logging.exception("❌ Could not sync the assistant's prompt and tools")
+
+    # Join the shared job store and the election for the process that fires reminders
+    start_scheduler()
+
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
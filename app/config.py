@@ -22,7 +22,20 @@ def load_configurations(app):
     app.config["TWILIO_AUTH_TOKEN"] = os.getenv("TWILIO_AUTH_TOKEN")
     app.config["TWILIO_PHONE_NUMBER"] = os.getenv("TWILIO_PHONE_NUMBER")
     app.config["OPENAI_ASSISTANT_ID"] = os.getenv("OPENAI_ASSISTANT_ID")
-    
+
+    # Webhook ingestion: "async" acknowledges immediately and processes on a worker pool
+    app.config["WEBHOOK_MODE"] = os.getenv("WEBHOOK_MODE", "async")
+    app.config["WEBHOOK_WORKERS"] = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    app.config["WEBHOOK_QUEUE_SIZE"] = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+    # Merge messages that arrive while a user's previous turn is still running
+    app.config["WEBHOOK_COALESCE"] = os.getenv("WEBHOOK_COALESCE", "true").lower() == "true"
+    # Redelivery deduplication by WhatsApp message ID
+    app.config["DEDUP_CACHE_DIR"] = os.getenv("DEDUP_CACHE_DIR", "dedup_cache")
+    app.config["DEDUP_TTL"] = int(os.getenv("DEDUP_TTL", "86400"))
+    app.config["DEDUP_IN_PROGRESS_TTL"] = int(os.getenv("DEDUP_IN_PROGRESS_TTL", "600"))
+    # Push the local system prompt and tool schemas to OPENAI_ASSISTANT_ID at startup
+    app.config["OPENAI_SYNC_ASSISTANT"] = os.getenv("OPENAI_SYNC_ASSISTANT", "true").lower() == "true"
+
 
 def configure_logging():
     logging.basicConfig(
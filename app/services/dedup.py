@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+import diskcache
+from app.utils import metrics
+
+IN_PROGRESS = "in_progress"
+DONE = "done"
+
+
+class MessageDeduplicator:
+    """
+    Remembers which WhatsApp message IDs have been handled so that Meta's
+    redeliveries don't re-run the LLM pipeline or schedule jobs twice.
+
+    Claims live in a diskcache store shared by every worker process. A claim
+    starts as "in_progress" with a short TTL, so a message whose worker died
+    can be retried later, and becomes "done" with a long TTL once processed.
+    An in-memory LRU of finished IDs answers most redeliveries without I/O.
+    """
+
+    def __init__(self, directory="dedup_cache", ttl=86400, in_progress_ttl=600, capacity=10000):
+        self.cache = diskcache.Cache(directory)
+        self.ttl = ttl
+        self.in_progress_ttl = in_progress_ttl
+        self.capacity = capacity
+        self._done = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, message_id):
+        """
+        Try to take ownership of ``message_id``. Returns None when the caller should
+        process it, otherwise the state it is already in ("in_progress" or "done").
+        """
+        with self._lock:
+            if message_id in self._done:
+                self._done.move_to_end(message_id)
+                metrics.inc("webhook_duplicates_total", state=DONE)
+                return DONE
+
+        # add() only succeeds for the first claimant across all processes
+        if self.cache.add(message_id, IN_PROGRESS, expire=self.in_progress_ttl):
+            return None
+
+        state = self.cache.get(message_id, IN_PROGRESS)
+        if state == DONE:
+            self._remember_done(message_id)
+        metrics.inc("webhook_duplicates_total", state=state)
+        return state
+
+    def complete(self, message_id):
+        self.cache.set(message_id, DONE, expire=self.ttl)
+        self._remember_done(message_id)
+
+    def release(self, message_id):
+        """Drop a claim after a failure so a redelivery is processed again."""
+        self.cache.delete(message_id)
+
+    def _remember_done(self, message_id):
+        with self._lock:
+            self._done[message_id] = True
+            self._done.move_to_end(message_id)
+            while len(self._done) > self.capacity:
+                self._done.popitem(last=False)
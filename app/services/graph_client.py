@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from app.utils import metrics
+
+load_dotenv()
+
+# Graph API usage headers report percentages of the app / business quota
+USAGE_HEADERS = ["X-App-Usage", "X-Business-Use-Case-Usage"]
+
+
+class GraphClient:
+    """
+    Shared client for the WhatsApp Graph API.
+
+    One keep-alive ``requests.Session`` with a connection pool is reused by
+    every send and media call, so graph.facebook.com is not re-handshaked per
+    request. Every request has a timeout. Connection errors, 429 and 5xx
+    responses are retried with jittered exponential backoff, honouring
+    ``Retry-After``. When the usage headers say the app is close to its quota,
+    further requests are held back until access is regained.
+    """
+
+    def __init__(self, access_token, version, phone_number_id, pool_size=20,
+                 connect_timeout=3.05, read_timeout=10.0, max_retries=3,
+                 backoff=0.5, max_backoff=8.0, usage_threshold=90):
+        self.version = version
+        self.phone_number_id = phone_number_id
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.usage_threshold = usage_threshold
+
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+
+        self._throttled_until = 0.0
+        self._requests = 0
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("graph_connection_reuse_ratio", self.connection_reuse_ratio)
+
+    @property
+    def base_url(self):
+        return f"https://graph.facebook.com/{self.version}"
+
+    @property
+    def messages_url(self):
+        return f"{self.base_url}/{self.phone_number_id}/messages"
+
+    def get(self, url, endpoint="other", **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint="other", **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def request(self, method, url, endpoint="other", max_retries=None, **kwargs):
+        """``max_retries`` overrides the client default, e.g. 0 for callers that retry themselves."""
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if max_retries is None else max_retries
+
+        for attempt in range(max_retries + 1):
+            self._wait_for_quota()
+            with self._lock:
+                self._requests += 1
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc("graph_request_errors_total", endpoint=endpoint, error=type(e).__name__)
+                # A POST that timed out may have been delivered; don't send it twice
+                retryable = isinstance(e, requests.ConnectionError) and not isinstance(e, requests.ReadTimeout)
+                if attempt == max_retries or not (retryable or method == "GET"):
+                    raise
+                self._sleep(attempt)
+                continue
+            finally:
+                metrics.observe("graph_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+
+            metrics.inc("graph_responses_total", endpoint=endpoint, status=response.status_code)
+            self._track_usage(response)
+
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < max_retries:
+                logging.warning(f"🔁 Graph API {response.status_code} on {endpoint}, retrying")
+                self._sleep(attempt, response.headers.get("Retry-After"))
+                continue
+            return response
+
+    def connection_reuse_ratio(self):
+        """Share of requests that went over an already open connection."""
+        pools = self.adapter.poolmanager.pools
+        opened = sum(pools[key].num_connections for key in list(pools.keys()) if key in pools)
+        return round(1 - opened / self._requests, 4) if self._requests else 0.0
+
+    def _sleep(self, attempt, retry_after=None):
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+        time.sleep(delay)
+
+    def _wait_for_quota(self):
+        delay = self._throttled_until - time.monotonic()
+        if delay > 0:
+            metrics.inc("graph_throttled_total")
+            time.sleep(delay)
+
+    def _track_usage(self, response):
+        for header in USAGE_HEADERS:
+            raw = response.headers.get(header)
+            if not raw:
+                continue
+            try:
+                usage = json.loads(raw)
+            except ValueError:
+                continue
+
+            # X-Business-Use-Case-Usage nests a list of usages per business ID
+            entries = [usage] if header == "X-App-Usage" else [u for v in usage.values() for u in v]
+            for entry in entries:
+                peak = max(entry.get("call_count", 0), entry.get("total_time", 0), entry.get("total_cputime", 0))
+                metrics.set_gauge("graph_quota_usage_percent", peak, header=header)
+                if peak >= self.usage_threshold:
+                    pause = 60 * entry.get("estimated_time_to_regain_access", 0) or 5
+                    self._throttled_until = max(self._throttled_until, time.monotonic() + pause)
+                    logging.warning(f"🐢 Graph API usage at {peak}%, pausing requests for {pause}s")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_graph_client():
+    """Process-wide GraphClient configured from the environment."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GraphClient(
+                access_token=os.getenv("ACCESS_TOKEN"),
+                version=os.getenv("VERSION"),
+                phone_number_id=os.getenv("PHONE_NUMBER_ID"),
+                pool_size=int(os.getenv("GRAPH_POOL_SIZE", "20")),
+                read_timeout=float(os.getenv("GRAPH_TIMEOUT", "10")),
+                max_retries=int(os.getenv("GRAPH_MAX_RETRIES", "3")),
+            )
+        return _client
@@ -0,0 +1,153 @@
+import logging
+import os
+import re
+import threading
+import time
+from dateutil.parser import parse
+from dotenv import load_dotenv
+from app.services.scheduler import delete_task
+from app.services.task_store import task_store
+from app.utils import metrics
+from app.utils.time_handler import get_zone
+
+load_dotenv()
+
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+# Matches scoring below this go to the assistant
+INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.8"))
+
+_TASK_WORDS = r"(?:reminders?|tasks?|jobs?|schedules?)"
+
+# (pattern, confidence); patterns match the whole normalised message
+LIST_PATTERNS = [
+    (re.compile(rf"^(?:what|which) (?:are|r) (?:my|the) (?:pending |upcoming |scheduled |current )?{_TASK_WORDS}$"), 1.0),
+    (re.compile(rf"^(?:show|list|get|see|check) (?:me )?(?:all )?(?:of )?(?:my )?(?:pending |upcoming |scheduled |current )?{_TASK_WORDS}$"), 1.0),
+    (re.compile(rf"^(?:my )?(?:pending|upcoming|scheduled|current) {_TASK_WORDS}$"), 1.0),
+    (re.compile(rf"^do i have any (?:pending |upcoming |scheduled )?{_TASK_WORDS}$"), 0.95),
+    (re.compile(rf"^(?:my )?{_TASK_WORDS}$"), 0.85),
+]
+CANCEL_PATTERNS = [
+    (re.compile(r"^(?:please )?(?:cancel|delete|remove) (?:my )?(?:reminder |task |job )?(?:number |no |id )?#?(\d+)(?: please)?$"), 1.0),
+    (re.compile(r"^(?:please )?(?:cancel|delete|remove) (?:my )?(?:reminder |task |job )?(?:number |no |id )?#?(\d+) .{1,20}$"), 0.6),
+]
+# Mentions of pending tasks inside a longer message: never confident enough on their own
+LIST_HINT = re.compile(rf"\b(?:pending|upcoming|scheduled)\b.*\b{_TASK_WORDS}\b")
+
+
+def normalise(text):
+    text = text.lower().strip()
+    text = re.sub(r"[^\w#\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def classify(text):
+    """
+    Best local intent for a message: ``(intent, confidence, job_id)`` where
+    intent is "list_pending", "cancel" or None.
+    """
+    text = normalise(text)
+    for pattern, confidence in CANCEL_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return "cancel", confidence, match.group(1)
+    for pattern, confidence in LIST_PATTERNS:
+        if pattern.match(text):
+            return "list_pending", confidence, None
+    if LIST_HINT.search(text):
+        return "list_pending", 0.5, None
+    return None, 0.0, None
+
+
+def format_time(iso_time, timezone):
+    try:
+        when = parse(iso_time)
+    except (TypeError, ValueError):
+        return iso_time or "?"
+    if when.tzinfo is not None:
+        when = when.astimezone(get_zone(timezone))
+    return when.strftime("%a %d %b, %H:%M")
+
+
+def format_pending(tasks, timezone):
+    if not tasks:
+        return "You have no pending reminders. 🎉"
+    lines = ["📋 Your pending reminders:", ""]
+    for job_id, info in tasks.items():
+        repeat = " 🔁" if info.get("recurrence") else ""
+        lines.append(f"**{job_id}** — {info['task']} ({info['type']}){repeat}")
+        lines.append(f"    {format_time(info['event_time'], timezone)}")
+    lines += ["", "To cancel one, reply \"cancel <ID>\"."]
+    return "\n".join(lines)
+
+
+class IntentRouter:
+    """
+    Answers a few deterministic requests ("what are my reminders?", "cancel
+    1003") straight from the task store instead of running the assistant.
+    Anything it is not confident about returns None and goes to the assistant.
+
+    Tracks its hit rate, and estimates the latency saved per hit from a moving
+    average of how long the assistant takes for the messages it does not handle.
+    """
+
+    def __init__(self, threshold=0.8, enabled=True):
+        self.threshold = threshold
+        self.enabled = enabled
+        self.hits = 0
+        self.total = 0
+        self.assistant_latency = None  # moving average, seconds
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("intent_router_hit_rate", self.hit_rate)
+
+    def hit_rate(self):
+        return round(self.hits / self.total, 4) if self.total else 0.0
+
+    def route(self, wa_id, text, timezone):
+        """Reply text for ``text`` if handled locally, else None."""
+        if not self.enabled:
+            return None
+
+        started = time.perf_counter()
+        intent, confidence, job_id = classify(text)
+        reply = None
+        if intent is not None and confidence >= self.threshold:
+            if intent == "list_pending":
+                reply = format_pending(task_store.get_pending_tasks(wa_id), timezone)
+            elif intent == "cancel":
+                reply = self._cancel(wa_id, job_id)
+
+        with self._lock:
+            self.total += 1
+            if reply is not None:
+                self.hits += 1
+        metrics.inc("intent_router_messages_total", intent=intent or "none", routed=reply is not None)
+        if reply is None:
+            return None
+
+        elapsed = time.perf_counter() - started
+        metrics.observe("intent_router_seconds", elapsed, intent=intent)
+        if self.assistant_latency is not None:
+            metrics.inc("intent_router_latency_saved_seconds_total", max(self.assistant_latency - elapsed, 0.0))
+        logging.info(f"⚡ Answered {intent} for {wa_id} locally in {elapsed * 1000:.1f} ms (confidence {confidence})")
+        return reply
+
+    def observe_assistant_latency(self, seconds, weight=0.1):
+        """Feed in how long an assistant reply took, for the latency-saved estimate."""
+        with self._lock:
+            if self.assistant_latency is None:
+                self.assistant_latency = seconds
+            else:
+                self.assistant_latency += weight * (seconds - self.assistant_latency)
+
+    def _cancel(self, wa_id, job_id):
+        info = task_store.get_pending_tasks(wa_id).get(job_id)
+        if info is None:
+            return f"I couldn't find a pending reminder with ID {job_id}. Send \"my reminders\" to see them."
+        if not delete_task(wa_id, job_id):
+            # Let the assistant deal with whatever went wrong
+            return None
+        return f"✅ Cancelled **{job_id}** — {info['task']} ({info['type']})."
+
+
+intent_router = IntentRouter(threshold=INTENT_ROUTER_THRESHOLD, enabled=INTENT_ROUTER_ENABLED)
@@ -1,65 +1,240 @@
 import smtplib
 import re
-import requests
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from email.message import EmailMessage
 from twilio.rest import Client
 from twilio.twiml.voice_response import VoiceResponse
 import os
 from dotenv import load_dotenv
+from app.services.outbound import send_whatsapp_payload, REMINDER
+from app.utils import metrics
 
 # Load from .env
 load_dotenv()
-ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
-PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
-VERSION = os.getenv("VERSION")
 SMTP_EMAIL = os.getenv("SMTP_EMAIL")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+# Point these at a local debugging server (SMTP_SSL=false, no credentials) for testing
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+# Sender threads, each holding one authenticated connection
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+# Emails queued together go out back to back over one connection, up to this many
+SMTP_BATCH_SIZE = int(os.getenv("SMTP_BATCH_SIZE", "50"))
+# Idle connections are closed after this long
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
 TWILIO_SID = os.getenv("TWILIO_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
+# How long a reminder job waits for the send queue to deliver its message
+SEND_RESULT_TIMEOUT = float(os.getenv("SEND_RESULT_TIMEOUT", "300"))
+
+
+def delivery_result(channel, to, ok, error=None, **detail):
+    """
+    Outcome of one reminder delivery. Returned by every notifier job so the
+    scheduler's job listener can record it against the task.
+    """
+    metrics.inc("notifier_deliveries_total", channel=channel, ok=ok)
+    return {"ok": ok, "channel": channel, "to": to, "error": error, **detail}
+
+
+class SMTPSender:
+    """
+    Sends email over a small pool of long-lived, authenticated SMTP connections.
+
+    Each sender thread keeps its own connection open between emails and closes
+    it after SMTP_IDLE_TIMEOUT. When it picks up a message it also drains
+    whatever else is queued (up to SMTP_BATCH_SIZE), so a burst of reminders
+    due together costs one handshake and login instead of one per email. A
+    dropped connection is reopened and the message retried once.
+    """
+
+    def __init__(self, host, port, use_ssl, username=None, password=None, workers=2,
+                 batch_size=50, idle_timeout=60.0, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.workers = workers
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connections_opened = 0
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("smtp_queue_depth", self._queue.qsize)
+
+    def submit(self, msg):
+        self._start()
+        future = Future()
+        self._queue.put((msg, future))
+        return future
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"smtp-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.username and self.password:
+            try:
+                smtp.login(self.username, self.password)
+            except smtplib.SMTPException:
+                self._close(smtp)
+                raise
+        self.connections_opened += 1
+        metrics.inc("smtp_connections_opened_total")
+        return smtp
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def _run(self):
+        smtp = None
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                if smtp is not None:
+                    self._close(smtp)
+                    smtp = None
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            metrics.observe("smtp_batch_size", len(batch), buckets=(1, 2, 5, 10, 25, 50, 100))
+
+            for msg, future in batch:
+                smtp, error = self._send(smtp, msg)
+                future.set_result(error)
+
+    def _send(self, smtp, msg):
+        """Send one message, reconnecting once if needed. Returns (connection, error or None)."""
+        for attempt in (1, 2):
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                smtp.send_message(msg)
+                return smtp, None
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                # Stale or broken connection: drop it and try again on a fresh one
+                if smtp is not None:
+                    self._close(smtp)
+                smtp = None
+                if attempt == 2:
+                    return None, str(e)
+            except smtplib.SMTPException as e:
+                # The server rejected this message; the connection is still usable
+                return smtp, str(e)
+
+
+_smtp_sender = None
+_twilio_client = None
+_clients_lock = threading.Lock()
+
+
+def get_smtp_sender():
+    global _smtp_sender
+    with _clients_lock:
+        if _smtp_sender is None:
+            _smtp_sender = SMTPSender(
+                SMTP_HOST, SMTP_PORT, SMTP_SSL, SMTP_EMAIL, SMTP_PASSWORD,
+                workers=SMTP_POOL_SIZE,
+                batch_size=SMTP_BATCH_SIZE,
+                idle_timeout=SMTP_IDLE_TIMEOUT,
+                timeout=SMTP_TIMEOUT,
+            )
+        return _smtp_sender
+
+
+def get_twilio_client():
+    """One Twilio client (and HTTP session) shared by every call reminder."""
+    global _twilio_client
+    with _clients_lock:
+        if _twilio_client is None:
+            _twilio_client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
+        return _twilio_client
+
+
+def set_twilio_client(client):
+    """Swap in another client, e.g. a stub when testing call reminders."""
+    global _twilio_client
+    with _clients_lock:
+        _twilio_client = client
+
 
 def send_whatsapp_message(to: str, message: str):
-    url = f"https://graph.facebook.com/{VERSION}/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "text",
         "text": {"body": message}
     }
-    response = requests.post(url, headers=headers, json=payload)
-    print(f"📤 WhatsApp: {response.status_code} - {response.text}")
+    # Reminders go through the shared send queue behind interactive replies
+    outcome = send_whatsapp_payload(payload, priority=REMINDER).result(timeout=SEND_RESULT_TIMEOUT)
+    logging.info(f"📤 WhatsApp reminder to {to}: {outcome}")
+    return delivery_result(
+        "whatsapp", to, outcome["ok"], outcome["error"],
+        outcome=outcome["outcome"], status=outcome["status"], attempts=outcome["attempts"],
+    )
 
 def send_email(to_email: str, subject: str, body: str):
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = SMTP_EMAIL
+    msg["To"] = to_email
+    msg.set_content(body)
+
+    started = time.perf_counter()
     try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = SMTP_EMAIL
-        msg["To"] = to_email
-        msg.set_content(body)
-
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(SMTP_EMAIL, SMTP_PASSWORD)
-            smtp.send_message(msg)
-        print("✅ Email sent to", to_email)
+        error = get_smtp_sender().submit(msg).result(timeout=SEND_RESULT_TIMEOUT)
     except Exception as e:
-        print("❌ Email error:", e)
+        error = str(e) or type(e).__name__
+    metrics.observe("notifier_send_seconds", time.perf_counter() - started, channel="email")
+
+    if error:
+        logging.error(f"❌ Email to {to_email} failed: {error}")
+    else:
+        logging.info(f"✅ Email sent to {to_email}")
+    return delivery_result("email", to_email, error is None, error)
 
 def make_voice_call(to_number: str, message: str):
-    try:
-        client = Client(TWILIO_SID, TWILIO_AUTH_TOKEN)
-        cleaned_number = re.sub(r"[^\d+]", "", to_number)
-        voice = VoiceResponse()
-        voice.say(message)
+    cleaned_number = re.sub(r"[^\d+]", "", to_number)
+    voice = VoiceResponse()
+    voice.say(message)
 
-        call = client.calls.create(
+    started = time.perf_counter()
+    try:
+        call = get_twilio_client().calls.create(
             to=cleaned_number,
             from_=TWILIO_PHONE_NUMBER,
             twiml=str(voice)
         )
-        print(f"📞 Voice call started to {cleaned_number}, SID: {call.sid}")
     except Exception as e:
-        print("❌ Voice call error:", e)
\ No newline at end of file
+        logging.error(f"❌ Voice call to {cleaned_number} failed: {e}")
+        return delivery_result("call", cleaned_number, False, str(e))
+    finally:
+        metrics.observe("notifier_send_seconds", time.perf_counter() - started, channel="call")
+
+    logging.info(f"📞 Voice call started to {cleaned_number}, SID: {call.sid}")
+    return delivery_result("call", cleaned_number, True, sid=call.sid)
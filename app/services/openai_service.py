@@ -1,17 +1,90 @@
-from openai import OpenAI
-import shelve
+from openai import OpenAI, BadRequestError, DefaultHttpxClient
 from dotenv import load_dotenv
+from contextlib import contextmanager
 import os
 import time
 import logging
 import json
-from app.services.scheduler import schedule_job, delete_task
-from app.utils.time_handler import get_location_from_ip, get_current_datetime_by_timezone
+import threading
+from itertools import islice
+import pytz
+from app.services.scheduler import schedule_jobs, delete_task
+from app.utils.time_handler import resolve_user_timezone, get_current_datetime_by_timezone, get_zone
 from app.utils.pending_task import get_pending_tasks
+from app.services.run_engine import execute_run
+from app.services.tool_executor import ToolExecutor
+from app.services.thread_store import create_thread_store, migrate_from_shelve
+from app.utils import metrics
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+# Counts the HTTP calls made to OpenAI while handling one inbound message
+_request_counter = threading.local()
+
+def _count_openai_request(request):
+    metrics.inc("openai_requests_total")
+    if getattr(_request_counter, "count", None) is not None:
+        _request_counter.count += 1
+
+@contextmanager
+def count_openai_calls():
+    _request_counter.count = 0
+    try:
+        yield _request_counter
+    finally:
+        metrics.observe(
+            "openai_calls_per_message",
+            _request_counter.count,
+            buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30),
+        )
+        logging.info(f"📊 OpenAI calls for this message: {_request_counter.count}")
+        _request_counter.count = None
+
+# OPENAI_BASE_URL (read by the SDK) can point the client at a local fake Assistants
+# server, e.g. the one in scripts/run_engine_smoke.py --serve
+client = OpenAI(
+    api_key=OPENAI_API_KEY,
+    http_client=DefaultHttpxClient(event_hooks={"request": [_count_openai_request]}),
+)
+
+# "stream" uses the streaming run API; "poll" falls back to adaptive backoff polling
+RUN_OPTIONS = {
+    "mode": os.getenv("OPENAI_RUN_MODE", "stream"),
+    "poll_min_interval": float(os.getenv("OPENAI_POLL_MIN_INTERVAL", "0.2")),
+    "poll_max_interval": float(os.getenv("OPENAI_POLL_MAX_INTERVAL", "1.0")),
+}
+
+# Context management: cap the history each run reads, and once a thread gets long,
+# roll it into a summary that starts a fresh thread
+OPENAI_CONTEXT_LAST_MESSAGES = int(os.getenv("OPENAI_CONTEXT_LAST_MESSAGES", "20"))  # 0 = OpenAI's "auto"
+OPENAI_MAX_PROMPT_TOKENS = int(os.getenv("OPENAI_MAX_PROMPT_TOKENS", "0"))  # 0 = no cap
+OPENAI_ROTATE_AFTER_TURNS = int(os.getenv("OPENAI_ROTATE_AFTER_TURNS", "50"))  # 0 = never
+OPENAI_ROTATE_PROMPT_TOKENS = int(os.getenv("OPENAI_ROTATE_PROMPT_TOKENS", "8000"))  # 0 = never
+OPENAI_SUMMARY_MODEL = os.getenv("OPENAI_SUMMARY_MODEL", "gpt-4o-mini")
+# Most messages of a thread read when summarising it (a thread is rotated after OPENAI_ROTATE_AFTER_TURNS turns)
+OPENAI_SUMMARY_MESSAGES = int(os.getenv("OPENAI_SUMMARY_MESSAGES", "200"))
+
+RUN_PARAMS = {}
+if OPENAI_CONTEXT_LAST_MESSAGES > 0:
+    RUN_PARAMS["truncation_strategy"] = {"type": "last_messages", "last_messages": OPENAI_CONTEXT_LAST_MESSAGES}
+if OPENAI_MAX_PROMPT_TOKENS > 0:
+    RUN_PARAMS["max_prompt_tokens"] = OPENAI_MAX_PROMPT_TOKENS
+RUN_OPTIONS["run_params"] = RUN_PARAMS
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+SUMMARY_PROMPT = """
+Summarise this conversation between a user and their WhatsApp reminder assistant
+so it can continue in a new thread. It may start with a summary of the conversation
+before it: fold that in, so nothing from earlier is lost. Keep the user's name,
+preferences, timezone, ongoing requests and any details of tasks being discussed.
+Be concise; plain text.
+"""
+
+# Given to every run of a rotated thread. The truncation strategy would drop a
+# summary stored as a message in the thread after a few turns; instructions stay.
+SUMMARY_INSTRUCTIONS = "Summary of your earlier conversation with this user:\n{summary}"
 
 def upload_file(path):
     # Upload a file with an "assistants" purpose
@@ -52,6 +125,11 @@ Your responsibilities:
     - Follow deletion flow as above.
     - After successful deletion, ask for the new time and then call `schedule_job` again.
 
+6. For repeating reminders ("every day at 9", "every 2 hours"), call `schedule_job` once with a `recurrence`;
+   never schedule each occurrence separately. Put several tasks into one `schedule_job` call.
+
+7. If the user tells you their timezone or where they are, call `set_timezone` with the IANA name (e.g. "Europe/London").
+
 Only return this JSON (with correct keys) if the user confirms. Do not include any extra text.
 """
 
@@ -60,25 +138,51 @@ tools = [
         "type": "function",
         "function": {
             "name": "schedule_job",
-            "description": "Schedules a task on WhatsApp, email, call or any combination of these three.",
+            "description": "Schedules one or more tasks, each on WhatsApp, email, call or any combination of these three, once or on a repeating schedule.",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "type": {
+                    "tasks": {
                         "type": "array",
-                        "items": {"type": "string"},
-                        "description": "Channels to use: whatsapp, email, call"
-                    },
-                    "task": {"type": "string"},
-                    "time": {"type": "string", "format": "date-time"},
-                    "reminder_message": {"type": "string"},
-                    "email": {"type": "string"},
-                    "email_subject": {"type": "string"},
-                    "email_body": {"type": "string"},
-                    "mobile_no": {"type": "string"},
-                    "call_message": {"type": "string"}
+                        "description": "All tasks to schedule, in a single call",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "type": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "description": "Channels to use: whatsapp, email, call"
+                                },
+                                "task": {"type": "string"},
+                                "time": {
+                                    "type": "string",
+                                    "format": "date-time",
+                                    "description": "When to send it, or when a repeating schedule starts"
+                                },
+                                "recurrence": {
+                                    "type": "object",
+                                    "description": "Only for repeating tasks: set either cron or interval_minutes",
+                                    "properties": {
+                                        "cron": {
+                                            "type": "string",
+                                            "description": "5-field cron in the user's timezone, day names for weekdays, e.g. '0 9 * * mon-fri'"
+                                        },
+                                        "interval_minutes": {"type": "integer"},
+                                        "until": {"type": "string", "format": "date-time"}
+                                    }
+                                },
+                                "reminder_message": {"type": "string"},
+                                "email": {"type": "string"},
+                                "email_subject": {"type": "string"},
+                                "email_body": {"type": "string"},
+                                "mobile_no": {"type": "string"},
+                                "call_message": {"type": "string"}
+                            },
+                            "required": ["type", "task", "time"]
+                        }
+                    }
                 },
-                "required": ["type", "task", "time"]
+                "required": ["tasks"]
             }
         }
     },
@@ -109,19 +213,113 @@ tools = [
                 "properties": {}
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "set_timezone",
+            "description": "Stores the user's timezone, used for the timestamp on their messages and for their reminders.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "timezone": {
+                        "type": "string",
+                        "description": "IANA timezone name, e.g. Europe/London"
+                    }
+                },
+                "required": ["timezone"]
+            }
+        }
     }
 ]
 
+# Local implementations of the tools above. "read" tools run concurrently with each
+# other; a change between reads and writes is an ordering barrier (see plan_stages).
+TOOL_REGISTRY = {
+    # Older assistants send one flat task instead of a "tasks" list
+    "schedule_job": {
+        "fn": lambda wa_id, args: {"job_ids": schedule_jobs(
+            wa_id, args["tasks"] if "tasks" in args else [args], get_user_timezone(wa_id),
+        )},
+        "kind": "write",
+    },
+    "delete_task": {"fn": lambda wa_id, args: delete_task(wa_id, args["job_id"]), "kind": "write"},
+    "get_pending_tasks": {"fn": lambda wa_id, args: get_pending_tasks(wa_id), "kind": "read"},
+    "set_timezone": {"fn": lambda wa_id, args: set_user_timezone(wa_id, args["timezone"]), "kind": "write"},
+}
+
+tool_executor = ToolExecutor(
+    TOOL_REGISTRY,
+    max_workers=int(os.getenv("TOOL_WORKERS", "8")),
+    timeout=float(os.getenv("TOOL_TIMEOUT", "15")),
+)
+
 def create_assistant():
     assistant = client.beta.assistants.create(
         name="WhatsApp AI Assistant",
         instructions=system_prompt,
         tools=tools,
         model="gpt-4o-mini-2024-07-18",
-        temprature=0.3
+        temperature=0.3
     )
     return assistant
 
+def _tool_schemas(tool_list):
+    """{name: {"description", "parameters"}} for the function tools in ``tool_list``."""
+    schemas = {}
+    for tool in tool_list:
+        tool = tool if isinstance(tool, dict) else tool.model_dump()
+        if tool.get("type") == "function":
+            function = tool["function"]
+            schemas[function["name"]] = {
+                "description": function.get("description"),
+                "parameters": function.get("parameters"),
+            }
+    return schemas
+
+def assistant_drift(assistant):
+    """
+    Differences between a deployed assistant and the local system prompt, tool
+    schemas and TOOL_REGISTRY, as human-readable strings. Empty when in sync.
+    """
+    drift = []
+    if (assistant.instructions or "") != system_prompt:
+        drift.append("instructions differ from system_prompt")
+
+    local = _tool_schemas(tools)
+    deployed = _tool_schemas(assistant.tools or [])
+    for name in sorted(local.keys() - deployed.keys()):
+        drift.append(f"tool {name} is not deployed")
+    for name in sorted(deployed.keys() - local.keys()):
+        drift.append(f"deployed tool {name} is not defined locally")
+    for name in sorted(local.keys() & deployed.keys()):
+        if local[name] != deployed[name]:
+            drift.append(f"tool {name} has a different schema")
+    for name in sorted(deployed.keys() - TOOL_REGISTRY.keys()):
+        drift.append(f"deployed tool {name} has no implementation in TOOL_REGISTRY")
+    return drift
+
+def sync_assistant(update=True):
+    """
+    Compare OPENAI_ASSISTANT_ID with the local prompt and tool schemas and, if
+    ``update``, push ours when they differ. Runs call the assistant by ID, so
+    without this a changed tool schema never reaches the model. Returns the
+    drift that is left.
+    """
+    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+    drift = assistant_drift(assistant)
+    if drift and update:
+        logging.info(f"🛠️ Updating assistant {OPENAI_ASSISTANT_ID}: {'; '.join(drift)}")
+        assistant = client.beta.assistants.update(OPENAI_ASSISTANT_ID, instructions=system_prompt, tools=tools)
+        drift = assistant_drift(assistant)
+
+    metrics.set_gauge("assistant_schema_drift", len(drift))
+    if drift:
+        logging.error(f"❌ Assistant {OPENAI_ASSISTANT_ID} is out of sync: {'; '.join(drift)}")
+    else:
+        logging.info(f"✅ Assistant {OPENAI_ASSISTANT_ID} matches the local prompt and tools")
+    return drift
+
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
 
 if not OPENAI_ASSISTANT_ID:
@@ -131,18 +329,35 @@ if not OPENAI_ASSISTANT_ID:
     # Optionally write to .env or print it
     print("🔑 New Assistant Created:", OPENAI_ASSISTANT_ID)
 
+# wa_id -> thread_id, cached in memory in front of a store shared by all workers
+thread_store = create_thread_store()
+migrate_from_shelve(thread_store, "threads_db")
+
 def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
+    return thread_store.get(wa_id)
 
 def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
+    thread_store.set(wa_id, thread_id)
+
+def get_user_timezone(wa_id):
+    return resolve_user_timezone(wa_id, thread_store.get_timezone(wa_id))
+
+def set_user_timezone(wa_id, timezone):
+    """Store a per-user timezone override next to the user's thread."""
+    try:
+        get_zone(timezone)
+    except pytz.UnknownTimeZoneError:
+        return {"error": f"Unknown timezone: {timezone}"}
+    thread_store.set_timezone(wa_id, timezone)
+    return {"timezone": timezone}
 
 def wait_for_active_run_to_finish(thread_id, timeout=60):
     """Check for active run in a thread and wait until it's done."""
     runs = client.beta.threads.runs.list(thread_id=thread_id)
-    active_run = next((r for r in runs.data if r.status == "in_progress"), None)
+    active_run = next(
+        (r for r in runs.data if r.status in ["queued", "in_progress", "requires_action", "cancelling"]),
+        None,
+    )
 
     if active_run:
         logging.info(f"🕒 Waiting for active run {active_run.id} to finish...")
@@ -156,91 +371,159 @@ def wait_for_active_run_to_finish(thread_id, timeout=60):
         return False
     return True
 
-def run_assistant(thread):
-    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+def add_user_message(thread_id, content):
+    client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=content,
+    )
 
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
+def get_latest_reply(thread_id, run_id):
+    """Fetch only the newest assistant message produced by ``run_id``."""
+    messages = client.beta.threads.messages.list(
+        thread_id=thread_id,
+        run_id=run_id,
+        order="desc",
+        limit=1,
     )
+    return messages.data[0].content[0].text.value
+
+def record_run_usage(wa_id, run):
+    """Per-run token usage, as histograms and as per-user totals in the thread store."""
+    usage = getattr(run, "usage", None)
+    if usage is None:
+        return
+    metrics.observe("assistant_prompt_tokens", usage.prompt_tokens, buckets=TOKEN_BUCKETS)
+    metrics.observe("assistant_completion_tokens", usage.completion_tokens, buckets=TOKEN_BUCKETS)
+    metrics.inc("assistant_tokens_total", usage.total_tokens)
+    thread_store.record_usage(wa_id, usage.prompt_tokens, usage.completion_tokens)
+
+def summarise_thread(thread_id, previous_summary=None):
+    """
+    Summarise a thread (up to its last OPENAI_SUMMARY_MESSAGES messages) with a
+    single chat completion, folding in the summary the thread started from.
+    """
+    pages = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=100)
+    messages = list(islice(pages, OPENAI_SUMMARY_MESSAGES))
+    transcript = "\n".join(
+        f"{message.role}: {part.text.value}"
+        for message in reversed(messages)
+        for part in message.content
+        if part.type == "text"
+    )
+    if previous_summary:
+        transcript = f"Summary of the conversation before these messages:\n{previous_summary}\n\n{transcript}"
+    completion = client.chat.completions.create(
+        model=OPENAI_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        temperature=0.2,
+    )
+    return completion.choices[0].message.content
+
+def maintain_context(wa_id):
+    """
+    Rotate the user's thread once it has run for OPENAI_ROTATE_AFTER_TURNS turns
+    or its last run read OPENAI_ROTATE_PROMPT_TOKENS prompt tokens. The old
+    thread and the summary it started from are rolled into a new summary, which
+    every run on the new thread gets as additional instructions, so each later
+    run reads a short history again. Called after the reply has been sent.
+    """
+    thread_id = check_if_thread_exists(wa_id)
+    stats = thread_store.get_context_stats(wa_id)
+    if thread_id is None or not stats:
+        return False
 
-    while run.status not in ["completed", "failed"]:
-        time.sleep(1)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+    due = (OPENAI_ROTATE_AFTER_TURNS and stats["turns"] >= OPENAI_ROTATE_AFTER_TURNS) \
+        or (OPENAI_ROTATE_PROMPT_TOKENS and stats["last_prompt_tokens"] >= OPENAI_ROTATE_PROMPT_TOKENS)
+    if not due:
+        return False
 
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    new_message = messages.data[0].content[0].text.value
-    logging.info(f"🔁 Assistant response: {new_message}")
-    return new_message
+    with metrics.timer("thread_rotation_seconds"):
+        summary = summarise_thread(thread_id, thread_store.get_summary(wa_id))
+        new_thread = client.beta.threads.create()
+        thread_store.rotate_thread(wa_id, new_thread.id, summary)
+    metrics.inc("thread_rotations_total")
+    logging.info(
+        f"🔄 Rotated thread for {wa_id} after {stats['turns']} turns "
+        f"({stats['last_prompt_tokens']} prompt tokens): {thread_id} -> {new_thread.id}"
+    )
+    return True
 
-def generate_response(message_body, wa_id, name):
+def record_local_exchange(wa_id, message_body, reply):
+    """
+    Append a message answered without a run (and our reply) to the user's
+    thread, in the assistant's usual JSON reply format, so later turns still
+    have the context.
+    """
     thread_id = check_if_thread_exists(wa_id)
     if thread_id is None:
-        logging.info(f"🧵 Creating new thread for {name} ({wa_id})")
-        thread = client.beta.threads.create()
-        store_thread(wa_id, thread.id)
-    else:
-        logging.info(f"📦 Retrieving existing thread for {name} ({wa_id})")
-        thread = client.beta.threads.retrieve(thread_id)
-
-    # 🛑 Wait if a run is still active
-    if not wait_for_active_run_to_finish(thread.id):
-        logging.warning("⏳ Run still active. Skipping new message.")
-        return {"type": [], "message": "Please wait, I'm still working on your last request."}
-    
-    t = get_current_datetime_by_timezone(get_location_from_ip()["timezone"])["current_time"]
+        return
+    t = get_current_datetime_by_timezone(get_user_timezone(wa_id))["current_time"]
+    add_user_message(thread_id, f'{t}\n' + message_body)
     client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=f'{t}\n' + message_body,
-    )
-
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=OPENAI_ASSISTANT_ID,
+        thread_id=thread_id,
+        role="assistant",
+        content=json.dumps({"type": [], "message": reply}, ensure_ascii=False),
     )
 
-    while True:
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-        if run.status == "completed":
-            break
-
-        if run.status == "requires_action":
-            tool_calls = run.required_action.submit_tool_outputs.tool_calls
-            tool_outputs = []
-
-            for call in tool_calls:
-                fn_name = call.function.name
-                arguments = json.loads(call.function.arguments)
-
-                if fn_name == "get_pending_tasks":
-                    result = get_pending_tasks(wa_id)
-                elif fn_name == "delete_task":
-                    result = delete_task(wa_id, arguments["job_id"])
-                elif fn_name == "schedule_job":
-                    result = schedule_job(wa_id, arguments)
-                else:
-                    result = {"error": f"Unknown function: {fn_name}"}
-
-                tool_outputs.append({
-                    "tool_call_id": call.id,
-                    "output": json.dumps(result),
-                })
+def run_tool_calls(wa_id, tool_calls):
+    """Execute the assistant's tool calls for ``wa_id`` and build the outputs to submit."""
+    return tool_executor.execute(wa_id, tool_calls)
 
-            run = client.beta.threads.runs.submit_tool_outputs(
-                thread_id=thread.id,
-                run_id=run.id,
-                tool_outputs=tool_outputs
-            )
-
-        elif run.status in ["failed", "cancelled"]:
-            return {"type": [], "message": "❌ Something went wrong."}
+def generate_response(message_body, wa_id, name):
+    with count_openai_calls():
+        return _generate_response(message_body, wa_id, name)
 
-        time.sleep(1)
+def _generate_response(message_body, wa_id, name):
+    # The stored thread ID is all we need; there is no point retrieving the thread object
+    thread_id = check_if_thread_exists(wa_id)
+    if thread_id is None:
+        logging.info(f"🧵 Creating new thread for {name} ({wa_id})")
+        thread_id = client.beta.threads.create().id
+        store_thread(wa_id, thread_id)
+    else:
+        logging.info(f"📦 Using existing thread for {name} ({wa_id})")
 
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    assistant_reply = messages.data[0].content[0].text.value
+    # Messages of one user are serialized by the dispatcher, so no run of ours is
+    # active here. A run left over from a crashed worker is only waited for if
+    # OpenAI actually rejects the new message because of it.
+    timezone = get_user_timezone(wa_id)
+    t = get_current_datetime_by_timezone(timezone)["current_time"]
+    try:
+        add_user_message(thread_id, f'{t}\n' + message_body)
+    except BadRequestError:
+        logging.warning("⏳ Thread has an active run, waiting for it before adding the message.")
+        if not wait_for_active_run_to_finish(thread_id):
+            raise
+        add_user_message(thread_id, f'{t}\n' + message_body)
+
+    options = RUN_OPTIONS
+    summary = thread_store.get_summary(wa_id)
+    if summary:
+        # Earlier threads reach the model through the run, not through the truncated history
+        options = {**RUN_OPTIONS, "run_params": {
+            **RUN_PARAMS, "additional_instructions": SUMMARY_INSTRUCTIONS.format(summary=summary),
+        }}
+
+    result = execute_run(
+        client,
+        thread_id,
+        OPENAI_ASSISTANT_ID,
+        lambda tool_calls: run_tool_calls(wa_id, tool_calls),
+        **options,
+    )
+    record_run_usage(wa_id, result["run"])
+    if result["status"] != "completed":
+        logging.error(f"❌ Run {result['run'].id} ended with status {result['status']}")
+        return "❌ Something went wrong."
+
+    # Streaming runs deliver the reply with the run; polling fetches just that one message
+    assistant_reply = result["reply"]
+    if assistant_reply is None:
+        assistant_reply = get_latest_reply(thread_id, result["run"].id)
 
     try:
         parsed = json.loads(assistant_reply)
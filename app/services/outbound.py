@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import diskcache
+import requests
+from dotenv import load_dotenv
+from app.services.graph_client import get_graph_client
+from app.utils import metrics
+
+load_dotenv()
+
+# Lower value = sent first
+INTERACTIVE = 0
+REMINDER = 1
+
+# WhatsApp error codes that mean "slow down" rather than "this message is bad"
+RETRYABLE_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available (0 when one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundQueue:
+    """
+    Central send queue for every outbound WhatsApp message.
+
+    Interactive replies jump ahead of scheduled reminders. A token bucket per
+    sending phone number keeps us inside the account's throughput tier, and
+    one per recipient avoids the pair rate limit when many reminders for the
+    same user are due together. Rate-limited and transient failures are
+    retried with backoff a bounded number of times, then written to a
+    dead-letter store. A send that timed out waiting for the response may
+    already have been delivered, so it is never retried: it is dead-lettered
+    with outcome "unknown". ``submit`` returns a Future that always resolves to
+    ``{"ok": bool, "outcome": "sent" | "failed" | "unknown", "status": ...,
+    "error": ..., "attempts": n}``.
+    """
+
+    def __init__(self, send, number_rate=80.0, number_burst=80, recipient_rate=0.5,
+                 recipient_burst=5, max_retries=3, retry_backoff=2.0, workers=8,
+                 dead_letter_dir="dead_letter"):
+        self.send = send
+        self.number_rate = number_rate
+        self.number_burst = number_burst
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letters = diskcache.Cache(dead_letter_dir)
+
+        self._ready = []  # (priority, seq, job)
+        self._delayed = []  # (ready_at, seq, job)
+        self._seq = itertools.count()
+        self._number_buckets = {}
+        self._recipient_buckets = {}
+        self._sent_at = deque()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+        self._thread = None
+
+        metrics.register_gauge("outbound_queue_depth", lambda: len(self._ready) + len(self._delayed))
+        metrics.register_gauge("outbound_send_rate_per_second", self.send_rate)
+
+    def submit(self, from_number, to, payload, priority=INTERACTIVE):
+        self._start()
+        job = {
+            "from": from_number,
+            "to": to,
+            "payload": payload,
+            "priority": priority,
+            "attempts": 0,
+            "enqueued_at": time.monotonic(),
+            "future": Future(),
+        }
+        with self._cond:
+            heapq.heappush(self._ready, (priority, next(self._seq), job))
+            self._cond.notify()
+        metrics.inc("outbound_enqueued_total", priority=priority)
+        return job["future"]
+
+    def send_rate(self, window=60.0):
+        cutoff = time.monotonic() - window
+        while self._sent_at and self._sent_at[0] < cutoff:
+            self._sent_at.popleft()
+        return round(len(self._sent_at) / window, 3)
+
+    def _start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name="outbound-dispatch", daemon=True)
+                self._thread.start()
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job, wait = self._next_job()
+                if job is None:
+                    self._cond.wait(timeout=wait)
+                    continue
+            metrics.observe("outbound_queue_wait_seconds", time.monotonic() - job["enqueued_at"])
+            self._pool.submit(self._deliver, job)
+
+    def _next_job(self):
+        """Pick the highest-priority job whose buckets allow a send. Called with the lock held."""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (job["priority"], next(self._seq), job))
+
+        wait = self._delayed[0][0] - now if self._delayed else None
+        if not self._ready:
+            return None, wait
+
+        _, _, job = heapq.heappop(self._ready)
+        number = self._bucket(self._number_buckets, job["from"], self.number_rate, self.number_burst)
+        recipient = self._bucket(self._recipient_buckets, job["to"], self.recipient_rate, self.recipient_burst)
+
+        number_wait = number.wait_time()
+        if number_wait > 0:
+            # The whole number is saturated: put the job back and wait for a token
+            heapq.heappush(self._ready, (job["priority"], next(self._seq), job))
+            return None, number_wait
+
+        recipient_wait = recipient.wait_time()
+        if recipient_wait > 0:
+            # Only this recipient is saturated: park the job so others can go first
+            heapq.heappush(self._delayed, (now + recipient_wait, next(self._seq), job))
+            return None, 0
+
+        number.take()
+        recipient.take()
+        self._sent_at.append(now)
+        return job, None
+
+    def _deliver(self, job):
+        job["attempts"] += 1
+        outcome = {"ok": False, "outcome": "failed", "status": None, "error": None, "attempts": job["attempts"]}
+        retryable = False
+
+        try:
+            response = self.send(job["payload"])
+            outcome["status"] = response.status_code
+            if response.ok:
+                outcome["ok"] = True
+                outcome["outcome"] = "sent"
+            else:
+                try:
+                    error = response.json().get("error", {})
+                except ValueError:
+                    error = {}
+                outcome["error"] = error.get("message") or response.text
+                retryable = response.status_code == 429 or response.status_code >= 500 \
+                    or error.get("code") in RETRYABLE_ERROR_CODES
+        except requests.ReadTimeout as e:
+            # The request reached Meta and may have been delivered; a retry could send it twice
+            outcome["outcome"] = "unknown"
+            outcome["error"] = str(e)
+        except requests.RequestException as e:
+            outcome["error"] = str(e)
+            retryable = True
+        except Exception as e:
+            # A bug rather than a network error: don't retry, but still resolve the Future
+            logging.exception(f"💥 Unexpected error sending to {job['to']}")
+            outcome["error"] = repr(e)
+
+        if outcome["ok"]:
+            metrics.inc("outbound_sent_total", priority=job["priority"])
+            job["future"].set_result(outcome)
+            return
+
+        if retryable and job["attempts"] <= self.max_retries:
+            metrics.inc("outbound_retries_total")
+            delay = self.retry_backoff * 2 ** (job["attempts"] - 1)
+            logging.warning(f"🔁 Send to {job['to']} failed ({outcome['error']}), retrying in {delay}s")
+            with self._cond:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+                self._cond.notify()
+            return
+
+        metrics.inc("outbound_dead_letters_total", outcome=outcome["outcome"])
+        logging.error(
+            f"💀 Giving up on message to {job['to']} after {job['attempts']} attempt(s) "
+            f"({outcome['outcome']}): {outcome['error']}"
+        )
+        try:
+            self.dead_letters.set(
+                f"{time.time():.6f}-{job['to']}",
+                {"to": job["to"], "payload": job["payload"], "priority": job["priority"], **outcome},
+            )
+        except Exception:
+            logging.exception(f"❌ Could not write dead letter for {job['to']}")
+        job["future"].set_result(outcome)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_outbound_queue():
+    """Process-wide OutboundQueue configured from the environment."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            graph = get_graph_client()
+            _queue = OutboundQueue(
+                # The queue does its own retrying; GraphClient retries on top would multiply attempts
+                send=lambda payload: graph.post(graph.messages_url, endpoint="messages", max_retries=0, json=payload),
+                number_rate=float(os.getenv("OUTBOUND_NUMBER_RATE", "80")),
+                number_burst=int(os.getenv("OUTBOUND_NUMBER_BURST", "80")),
+                recipient_rate=float(os.getenv("OUTBOUND_RECIPIENT_RATE", "0.5")),
+                recipient_burst=int(os.getenv("OUTBOUND_RECIPIENT_BURST", "5")),
+                max_retries=int(os.getenv("OUTBOUND_MAX_RETRIES", "3")),
+                workers=int(os.getenv("OUTBOUND_WORKERS", "8")),
+            )
+        return _queue
+
+
+def send_whatsapp_payload(payload, priority=INTERACTIVE):
+    """Queue a Graph API message payload from our business number."""
+    return get_outbound_queue().submit(get_graph_client().phone_number_id, payload["to"], payload, priority)
@@ -0,0 +1,138 @@
+import logging
+import time
+from app.utils import metrics
+
+# Statuses after which a run will not change any more
+TERMINAL_STATUSES = ["completed", "failed", "cancelled", "expired", "incomplete"]
+
+# Stream event -> phase the run enters
+STREAM_PHASES = {
+    "thread.run.queued": "queued",
+    "thread.run.in_progress": "in_progress",
+    "thread.run.requires_action": "requires_action",
+    "thread.run.cancelling": "cancelling",
+}
+
+
+class PhaseTimer:
+    """Accumulates how long a run spends in each phase."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phase = None
+        self.since = self.started
+        self.timings = {}
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self.phase is not None:
+            self.timings[self.phase] = self.timings.get(self.phase, 0.0) + now - self.since
+        self.phase, self.since = phase, now
+
+    def finish(self):
+        self.enter(None)
+        self.timings["total"] = time.perf_counter() - self.started
+        return {phase: round(seconds, 4) for phase, seconds in self.timings.items()}
+
+
+def execute_run(client, thread_id, assistant_id, handle_tool_calls, mode="stream",
+                poll_min_interval=0.2, poll_max_interval=1.0, poll_backoff=1.5, run_params=None):
+    """
+    Run the assistant on a thread until it reaches a terminal status.
+
+    ``handle_tool_calls(tool_calls)`` is called as soon as the run requires action
+    and must return the ``tool_outputs`` list to submit. In "stream" mode the
+    streaming run API pushes state changes to us; "poll" mode retrieves the run
+    with an adaptive backoff that resets after every state change. ``run_params``
+    (e.g. ``truncation_strategy``) are passed through when the run is created.
+
+    Returns a dict with the final ``run``, its ``status``, the assistant ``reply``
+    when the stream delivered it, and per-phase ``timings`` in seconds.
+    """
+    timer = PhaseTimer()
+    run_params = run_params or {}
+    if mode == "stream":
+        run, reply = _stream_run(client, thread_id, assistant_id, handle_tool_calls, timer, run_params)
+    else:
+        run, reply = _poll_run(
+            client, thread_id, assistant_id, handle_tool_calls, timer,
+            poll_min_interval, poll_max_interval, poll_backoff, run_params,
+        )
+
+    timings = timer.finish()
+    for phase, seconds in timings.items():
+        metrics.observe("assistant_run_phase_seconds", seconds, phase=phase, mode=mode)
+    metrics.inc("assistant_runs_total", status=run.status, mode=mode)
+    logging.info(f"⏱️ Run {run.id} {run.status} in {timings}")
+
+    return {"run": run, "status": run.status, "reply": reply, "timings": timings}
+
+
+def _submit_tool_outputs(run, handle_tool_calls, timer):
+    timer.enter("tool_execution")
+    tool_outputs = handle_tool_calls(run.required_action.submit_tool_outputs.tool_calls)
+    timer.enter("submitting")
+    return tool_outputs
+
+
+def _stream_run(client, thread_id, assistant_id, handle_tool_calls, timer, run_params):
+    timer.enter("created")
+    manager = client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant_id, **run_params)
+    reply = None
+
+    while True:
+        run = None
+        with manager as stream:
+            for event in stream:
+                if event.event in STREAM_PHASES:
+                    timer.enter(STREAM_PHASES[event.event])
+                    run = event.data
+                elif event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+                    run = event.data
+                elif event.event == "thread.message.completed" and event.data.role == "assistant":
+                    reply = event.data.content[0].text.value
+
+        if run is None:
+            raise RuntimeError(f"Run stream on thread {thread_id} ended without a run event")
+
+        if run.status != "requires_action":
+            return run, reply
+
+        # Dispatch tool calls the moment they arrive and keep streaming the same run
+        tool_outputs = _submit_tool_outputs(run, handle_tool_calls, timer)
+        manager = client.beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+        )
+
+
+def _poll_run(client, thread_id, assistant_id, handle_tool_calls, timer,
+              min_interval, max_interval, backoff, run_params):
+    timer.enter("created")
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_params)
+    last_status = None
+    delay = min_interval
+
+    while True:
+        if run.status != last_status:
+            timer.enter(run.status)
+            last_status = run.status
+            delay = min_interval
+
+        if run.status in TERMINAL_STATUSES:
+            return run, None
+
+        if run.status == "requires_action":
+            tool_outputs = _submit_tool_outputs(run, handle_tool_calls, timer)
+            run = client.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=run.id,
+                tool_outputs=tool_outputs,
+            )
+            last_status = None
+            continue
+
+        time.sleep(delay)
+        delay = min(delay * backoff, max_interval)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
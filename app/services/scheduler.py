@@ -1,58 +1,205 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+from sqlalchemy.exc import OperationalError
 from app.services.notifier import send_email, send_whatsapp_message, make_voice_call
-from datetime import datetime
+from app.services.task_store import task_store
+from app.utils.time_handler import get_zone
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from dateutil.parser import parse
+from dotenv import load_dotenv
 import diskcache
+import logging
 import pytz
 import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, every process is its own leader
+    fcntl = None
+
+load_dotenv()
 
 # Timezone
 IST = pytz.timezone("Asia/Kolkata")
 
-# Shared ID counter cache (namespaced by sender_id)
+# Shared job ID counter, incremented atomically across processes
 id_cache = diskcache.Cache("id_cache")
 
-# Scheduler setup
-scheduler = BackgroundScheduler()
-scheduler.start()
+SCHEDULER_DB_URL = os.getenv("SCHEDULER_DB_URL", "sqlite:///jobs.sqlite3")
+SCHEDULER_LOCK_FILE = os.getenv("SCHEDULER_LOCK_FILE", "scheduler.lock")
+# Held briefly by each process while it sets up the shared job store
+SCHEDULER_INIT_LOCK_FILE = os.getenv("SCHEDULER_INIT_LOCK_FILE", SCHEDULER_LOCK_FILE + ".init")
+# How often the leader looks for jobs added by other workers, and followers retry the lock
+SCHEDULER_POLL_INTERVAL = int(os.getenv("SCHEDULER_POLL_INTERVAL", "10"))
+SCHEDULER_MISFIRE_GRACE_TIME = int(os.getenv("SCHEDULER_MISFIRE_GRACE_TIME", "300"))
+SCHEDULER_COALESCE = os.getenv("SCHEDULER_COALESCE", "true").lower() == "true"
+# How often the leader archives finished tasks out of the task store
+TASK_COMPACT_INTERVAL_HOURS = float(os.getenv("TASK_COMPACT_INTERVAL_HOURS", "6"))
+# Threads per executor. Each reminder channel gets its own pool, so a slow
+# channel (SMTP, Twilio) can't starve the others; the pool size is that
+# channel's concurrency cap. "default" runs housekeeping and older jobs.
+SCHEDULER_EXECUTOR_WORKERS = {
+    "default": int(os.getenv("SCHEDULER_WORKERS", "10")),
+    "whatsapp": int(os.getenv("SCHEDULER_WHATSAPP_WORKERS", "20")),
+    "email": int(os.getenv("SCHEDULER_EMAIL_WORKERS", "10")),
+    "call": int(os.getenv("SCHEDULER_CALL_WORKERS", "5")),
+}
+# Shortest repeat allowed for an interval reminder
+SCHEDULER_MIN_INTERVAL_MINUTES = int(os.getenv("SCHEDULER_MIN_INTERVAL_MINUTES", "5"))
+# One-shot jobs due at the same instant are spread out at this many per second.
+# Off by default: scripts/bench_scheduler_burst.py shows the per-channel pools
+# alone drain a burst sooner (600 jobs: p99 lateness 5.0s vs 11.1s with 50/s).
+SCHEDULER_DISPATCH_RATE = float(os.getenv("SCHEDULER_DISPATCH_RATE", "0"))
+# Upper bound on how far a job is pushed back by that spreading
+SCHEDULER_MAX_DISPATCH_DELAY = float(os.getenv("SCHEDULER_MAX_DISPATCH_DELAY", "60"))
 
 
-# ✅ Helper: Get status_cache for a specific sender_id (separate DB)
-def get_status_cache(sender_id):
-    path = os.path.join("status_cache", sender_id)
-    os.makedirs(path, exist_ok=True)
-    return diskcache.Cache(directory=path)
+def build_executors(workers=None):
+    return {name: ThreadPoolExecutor(size) for name, size in (workers or SCHEDULER_EXECUTOR_WORKERS).items()}
 
 
-# ✅ Schedule a new job
-def schedule_job(sender_id, task):
-    time = parse(task["time"])
-    status_cache = get_status_cache(sender_id)
+def dispatch_delay(slot, rate=SCHEDULER_DISPATCH_RATE, max_delay=SCHEDULER_MAX_DISPATCH_DELAY):
+    """
+    Seconds to push back the ``slot``-th job due at the same instant. The first
+    ``rate`` jobs go out on time, the next ``rate`` a second later, and so on,
+    so a burst of reminders reaches the executors at a steady rate instead of
+    all at once.
+    """
+    if rate <= 0:
+        return 0.0
+    return min(int(slot // rate), max_delay)
 
-    # Initialize ID if not already present
-    if "ids" not in id_cache:
-        id_cache["ids"] = 1000  # or any base number you want
 
-    # Get user's status data
-    status_data = status_cache.get("status", {})
+# Scheduler setup: reminders live in a durable store shared by every worker,
+# internal housekeeping jobs in a per-process memory store. Nothing runs until
+# start_scheduler() is called (from create_app).
+job_store = SQLAlchemyJobStore(url=SCHEDULER_DB_URL)
+scheduler = BackgroundScheduler(
+    jobstores={
+        "default": job_store,
+        "local": MemoryJobStore(),
+    },
+    executors=build_executors(),
+    job_defaults={
+        "misfire_grace_time": SCHEDULER_MISFIRE_GRACE_TIME,
+        "coalesce": SCHEDULER_COALESCE,
+    },
+)
 
-    def add_job(job_type, func, args):
-        id_cache["ids"] += 1
-        job_id = str(id_cache["ids"])
-        scheduler.add_job(
-            func,
-            'date',
-            run_date=time,
-            args=args,
-            id=job_id
+
+class LeaderLock:
+    """Non-blocking exclusive file lock held for the life of the leader process."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def try_acquire(self):
+        if fcntl is None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+
+leader_lock = LeaderLock(SCHEDULER_LOCK_FILE)
+
+
+@contextmanager
+def startup_lock(path):
+    """Blocking exclusive file lock, so worker processes set up the job store one at a time."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _create_job_table():
+    """
+    Create the job store's table before the scheduler starts. The store's own
+    check-then-CREATE races when several gunicorn workers boot together.
+    """
+    try:
+        job_store.jobs_t.create(job_store.engine, checkfirst=True)
+    except OperationalError as e:
+        # Without flock (Windows) another process can still win the race
+        if "already exists" not in str(e):
+            raise
+
+
+def build_trigger(recurrence, start, tz=None):
+    """
+    APScheduler trigger for a recurring task, starting at ``start``:
+    ``{"cron": "0 9 * * mon-fri"}`` or ``{"interval_minutes": 1440}``, with an
+    optional ``"until"`` end time. Cron fields are read in ``tz`` (the user's
+    zone), so "9 every day" stays 9 local time across DST changes.
+    """
+    tz = tz or start.tzinfo or IST
+    until = parse(recurrence["until"]) if recurrence.get("until") else None
+    if recurrence.get("cron"):
+        fields = recurrence["cron"].split()
+        if len(fields) != 5:
+            raise ValueError(f"cron must have 5 fields (minute hour day month day_of_week): {recurrence['cron']!r}")
+        minute, hour, day, month, day_of_week = fields
+        return CronTrigger(
+            minute=minute, hour=hour, day=day, month=month, day_of_week=day_of_week,
+            start_date=start, end_date=until, timezone=tz,
         )
-        status_data[job_id] = {
+    if recurrence.get("interval_minutes"):
+        minutes = int(recurrence["interval_minutes"])
+        if minutes < SCHEDULER_MIN_INTERVAL_MINUTES:
+            raise ValueError(f"interval_minutes must be at least {SCHEDULER_MIN_INTERVAL_MINUTES}")
+        return IntervalTrigger(minutes=minutes, start_date=start, end_date=until, timezone=tz)
+    raise ValueError("recurrence needs either cron or interval_minutes")
+
+
+def _prepare_jobs(sender_id, task, new_tasks, jobs, tz):
+    """Allocate IDs and build the task rows and job specs for one task."""
+    time = parse(task["time"])
+    if time.tzinfo is None:
+        # A time without an offset is the user's wall-clock time
+        time = tz.localize(time)
+    recurrence = task.get("recurrence") or None
+    trigger = build_trigger(recurrence, time, tz) if recurrence else None
+    if trigger is not None:
+        # The row's event_time always shows the next run of the series
+        time = trigger.get_next_fire_time(None, time)
+        if time is None:
+            raise ValueError(f"recurrence {recurrence} never fires after {task['time']}")
+
+    def add_job(job_type, func, args):
+        # incr is a single transaction in the cache's SQLite file, so concurrent
+        # threads and worker processes never hand out the same ID
+        job_id = str(id_cache.incr("ids", default=1000))
+        jobs.append((job_id, func, args, time, trigger))
+        new_tasks[job_id] = {
             "task": task["task"],
             "type": job_type,
             "schedule_time": datetime.now(IST).isoformat(),
             "event_time": time.isoformat(),
-            "status": "pending"
+            "status": "pending",
+            "recurrence": recurrence,
         }
 
     if "whatsapp" in task["type"]:
@@ -64,49 +211,205 @@ def schedule_job(sender_id, task):
     if "call" in task["type"]:
         add_job("call", make_voice_call, [task["mobile_no"], task["call_message"]])
 
-    status_cache["status"] = status_data
+
+# ✅ Schedule new jobs: any number of tasks, each one-shot or recurring, in the user's timezone
+def schedule_jobs(sender_id, tasks, timezone=None):
+    tz = get_zone(timezone) if timezone else IST
+    new_tasks = {}
+    jobs = []
+    for task in tasks:
+        _prepare_jobs(sender_id, task, new_tasks, jobs, tz)
+
+    # Other reminders already due at the same exact time decide how far back one-shot jobs are pushed
+    slots = {}
+    if SCHEDULER_DISPATCH_RATE > 0:
+        slots = {ts: task_store.count_pending_at(ts)
+                 for ts in {time.timestamp() for _, _, _, time, trigger in jobs if trigger is None}}
+
+    # Record the tasks before the jobs exist, so a job that fires straight away
+    # always finds its row for the listener's status update
+    task_store.add_tasks(sender_id, new_tasks)
+    added = []
+    try:
+        for job_id, func, args, time, trigger in jobs:
+            executor = new_tasks[job_id]["type"]
+            if trigger is not None:
+                # A recurring task is one job with one row; each run is tracked as an occurrence
+                scheduler.add_job(func, trigger, args=args, id=job_id, executor=executor)
+            else:
+                run_date = time
+                if slots:
+                    run_date += timedelta(seconds=dispatch_delay(slots[time.timestamp()]))
+                    slots[time.timestamp()] += 1
+                scheduler.add_job(func, 'date', run_date=run_date, args=args, id=job_id, executor=executor)
+            added.append(job_id)
+    except Exception as e:
+        # All or nothing: the caller gets an error and may retry the whole batch,
+        # so no job of it may stay live and no row may stay "pending" without a job
+        _rollback_jobs(added, list(new_tasks), e)
+        raise
+
+    return list(new_tasks)
+
+
+def _rollback_jobs(added, job_ids, error):
+    for job_id in added:
+        try:
+            scheduler.remove_job(job_id)
+        except JobLookupError:
+            # Already fired and gone
+            pass
+        except Exception:
+            logging.exception(f"❌ Could not remove job {job_id} while rolling back its batch")
+    for job_id in job_ids:
+        task_store.set_status(job_id, "failed", delivery={"ok": False, "error": f"not scheduled: {error!r}"})
+    logging.error(f"❌ Scheduling failed, rolled back {len(added)} job(s) of a batch of {len(job_ids)}: {error!r}")
+
+
+# ✅ Schedule a new job
+def schedule_job(sender_id, task, timezone=None):
+    return schedule_jobs(sender_id, [task], timezone)
 
 
 # ✅ Delete a job (per sender)
 def delete_task(sender_id, job_id):
     try:
+        # Users may only delete their own jobs
+        owner = task_store.get_owner(job_id)
+        if owner is not None and owner != sender_id:
+            logging.warning(f"🚫 Refusing to delete job {job_id}: it belongs to another user")
+            return False
+
         scheduler.remove_job(job_id)
-        status_cache = get_status_cache(sender_id)
-        status_data = status_cache.get("status", {})
-        if job_id in status_data:
-            status_data[job_id]["status"] = "deleted"
-            status_cache["status"] = status_data
+        task_store.set_status(job_id, "deleted", sender_id=sender_id)
         return True
     except Exception as e:
         print(f"Error deleting job {job_id}: {e}")
         return False
 
 
-# ✅ Get all pending tasks for a sender
-def get_pending_tasks(sender_id):
-    status_cache = get_status_cache(sender_id)
-    return status_cache.get("status", {})
-
-
 # ✅ Background listener to track job execution results
 def job_listener(event):
+    if event.jobstore == "local":
+        return
+
+    # Notifier jobs return a delivery result; a job that raised has none
+    delivery = getattr(event, "retval", None)
+    if not isinstance(delivery, dict):
+        delivery = None
+
+    if event.code == EVENT_JOB_MISSED:
+        status = "missed"
+    elif event.exception:
+        status = "failed"
+        delivery = {"ok": False, "error": repr(event.exception)}
+    else:
+        status = "completed" if delivery is None or delivery.get("ok") else "failed"
+
     job_id = str(event.job_id)
-    base_path = "status_cache"
+    recurring = task_store.is_recurring(job_id)
+    if recurring is None:
+        logging.warning(f"⚠️ No task found for job {event.job_id}")
+    elif recurring:
+        # One row for the whole series: record this run and move the row on to the next one
+        job = scheduler.get_job(job_id)
+        task_store.record_occurrence(
+            job_id, event.scheduled_run_time, status, delivery,
+            next_run=job.next_run_time if job else None,
+        )
+    else:
+        # job_id is the task store's primary key: a single keyed update
+        task_store.set_status(job_id, status, delivery=delivery)
 
-    # Scan each user's DB to find the matching job_id
-    for sender_id in os.listdir(base_path):
-        user_path = os.path.join(base_path, sender_id)
-        if not os.path.isdir(user_path):
+
+# ✅ Reconcile the job store with the task store when taking over as leader
+def reconcile_jobs():
+    """
+    Tasks still marked "pending" whose job is gone from the job store (e.g. they
+    were scheduled with the old in-memory store before a restart) will never
+    fire: mark them "missed" if their time has passed, otherwise "lost".
+    """
+    now = datetime.now(IST)
+    fixed = 0
+    for job_id, sender_id, info in task_store.get_tasks_by_status("pending"):
+        if scheduler.get_job(job_id) is not None:
             continue
+        event_time = parse(info["event_time"])
+        if event_time.tzinfo is None:
+            event_time = IST.localize(event_time)
+        task_store.set_status(job_id, "missed" if event_time < now else "lost")
+        fixed += 1
+
+    logging.info(f"🧹 Reconciled job store with the task store: {fixed} orphaned task(s)")
+
+
+# ✅ Move finished tasks past the retention age into the archive
+def compact_tasks():
+    report = task_store.compact()
+    logging.info(
+        f"🗜️ Task store compaction: archived {report['archived']}, purged {report['purged']}, "
+        f"reclaimed {report['reclaimed_bytes']} bytes ({report['bytes_before']} -> {report['bytes_after']}), "
+        f"pending lookup {report['lookup_ms_before']} -> {report['lookup_ms_after']} ms"
+    )
+    return report
+
+
+def _poll_job_store():
+    # No-op: running it makes the leader re-read the shared store for new jobs
+    pass
+
+
+def _become_leader():
+    logging.info(f"👑 Process {os.getpid()} is the scheduler leader")
+    reconcile_jobs()
+    scheduler.add_job(
+        _poll_job_store,
+        "interval",
+        seconds=SCHEDULER_POLL_INTERVAL,
+        id="poll_job_store",
+        jobstore="local",
+        replace_existing=True,
+    )
+    scheduler.add_job(
+        compact_tasks,
+        "interval",
+        hours=TASK_COMPACT_INTERVAL_HOURS,
+        id="compact_tasks",
+        jobstore="local",
+        replace_existing=True,
+    )
+    scheduler.resume()
+
+
+def _wait_for_leadership():
+    while not leader_lock.try_acquire():
+        threading.Event().wait(SCHEDULER_POLL_INTERVAL)
+    _become_leader()
+
 
-        status_cache = diskcache.Cache(user_path)
-        status_data = status_cache.get("status", {})
+def start_scheduler(elect_leader=True):
+    """
+    Start the scheduler so this process can add or remove jobs in the shared
+    store. With ``elect_leader`` the process also competes for the leader lock,
+    and only the holder fires jobs; followers keep retrying the lock and take
+    over if the leader exits. Tools that only schedule or inspect jobs pass
+    ``elect_leader=False``, and processes that never call this (the dashboard,
+    read-only scripts) stay out of the job store altogether.
+    """
+    if scheduler.running:
+        return
+    with startup_lock(SCHEDULER_INIT_LOCK_FILE):
+        _create_job_table()
+        scheduler.start(paused=True)
 
-        if job_id in status_data:
-            status_data[job_id]["status"] = "failed" if event.exception else "completed"
-            status_cache["status"] = status_data
-            break
+    if not elect_leader:
+        return
+    if leader_lock.try_acquire():
+        _become_leader()
+    else:
+        logging.info(f"🕰️ Process {os.getpid()} is a scheduler follower")
+        threading.Thread(target=_wait_for_leadership, name="scheduler-leader-wait", daemon=True).start()
 
 
 # Attach the job listener to monitor execution
-scheduler.add_listener(job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+scheduler.add_listener(job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
@@ -0,0 +1,435 @@
+import base64
+import json
+import logging
+import os
+import time
+from dateutil.parser import parse
+from app.utils import metrics
+from app.utils.db import SQLiteDB
+
+# Columns returned to the assistant tools and the dashboard, in display order
+TASK_FIELDS = ["task", "type", "schedule_time", "event_time", "status", "recurrence"]
+# Columns the dashboard API can sort (and keyset-paginate) by
+SORT_COLUMNS = {"event_time": "event_ts", "updated_at": "updated_at"}
+
+# Finished tasks older than this move to the archive database
+TASK_RETENTION_DAYS = float(os.getenv("TASK_RETENTION_DAYS", "30"))
+# Archived tasks older than this are deleted for good (0 keeps them forever)
+TASK_ARCHIVE_RETENTION_DAYS = float(os.getenv("TASK_ARCHIVE_RETENTION_DAYS", "0"))
+
+
+def to_timestamp(iso_time):
+    return parse(iso_time).timestamp() if iso_time else None
+
+
+def encode_cursor(sort_value, job_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, job_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
+    try:
+        sort_value, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+    return sort_value, job_id
+
+
+def db_size(db):
+    conn = db.connect()
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+class TaskStore:
+    """
+    Every user's scheduled tasks in one SQLite database (WAL mode, per-thread
+    connections). One row per job, so status changes are single-row updates and
+    per-user queries go through the (sender_id, status, event_ts) index instead
+    of unpickling a whole per-user history.
+
+    Pending tasks have a partial index of their own, and ``compact`` moves
+    finished tasks past the retention age into a separate archive database, so
+    the hot table only grows with the number of live reminders.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        job_id TEXT PRIMARY KEY,
+        sender_id TEXT NOT NULL,
+        task TEXT,
+        type TEXT,
+        schedule_time TEXT,
+        event_time TEXT,
+        event_ts REAL,
+        status TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        delivery TEXT,
+        recurrence TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_sender_status_time ON tasks (sender_id, status, event_ts);
+    CREATE INDEX IF NOT EXISTS idx_tasks_status_time ON tasks (status, event_ts);
+    CREATE INDEX IF NOT EXISTS idx_tasks_pending ON tasks (sender_id, event_ts) WHERE status = 'pending';
+    CREATE INDEX IF NOT EXISTS idx_tasks_sender_time ON tasks (sender_id, event_ts, job_id);
+    CREATE INDEX IF NOT EXISTS idx_tasks_sender_updated ON tasks (sender_id, updated_at, job_id);
+    CREATE TABLE IF NOT EXISTS occurrences (
+        job_id TEXT NOT NULL,
+        run_ts REAL NOT NULL,
+        status TEXT NOT NULL,
+        delivery TEXT,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (job_id, run_ts)
+    );
+    CREATE INDEX IF NOT EXISTS idx_occurrences_updated ON occurrences (updated_at);
+    CREATE TABLE IF NOT EXISTS senders (
+        sender_id TEXT PRIMARY KEY,
+        created_at REAL NOT NULL
+    );
+    INSERT OR IGNORE INTO senders (sender_id, created_at) SELECT DISTINCT sender_id, 0 FROM tasks;
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        job_id TEXT PRIMARY KEY,
+        sender_id TEXT NOT NULL,
+        task TEXT,
+        type TEXT,
+        schedule_time TEXT,
+        event_time TEXT,
+        event_ts REAL,
+        status TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        delivery TEXT,
+        recurrence TEXT,
+        archived_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_archive_sender_time ON tasks (sender_id, event_ts);
+    CREATE INDEX IF NOT EXISTS idx_archive_sender_updated ON tasks (sender_id, updated_at, job_id);
+    CREATE INDEX IF NOT EXISTS idx_archive_archived_at ON tasks (archived_at);
+    """
+
+    ARCHIVE_COLUMNS = ["job_id", "sender_id", "task", "type", "schedule_time", "event_time",
+                       "event_ts", "status", "updated_at", "delivery", "recurrence"]
+    COLUMNS = {"tasks": {"delivery": "TEXT", "recurrence": "TEXT"}}
+
+    def __init__(self, path="tasks.sqlite3", archive_path="tasks_archive.sqlite3"):
+        self.db = SQLiteDB(path, self.SCHEMA, self.COLUMNS)
+        self.archive = SQLiteDB(archive_path, self.ARCHIVE_SCHEMA, self.COLUMNS)
+
+    def add_tasks(self, sender_id, tasks):
+        """Insert ``{job_id: info}`` for one sender in a single transaction."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO senders (sender_id, created_at) VALUES (?, ?)", (sender_id, now))
+            conn.executemany(
+                "INSERT OR REPLACE INTO tasks (job_id, sender_id, task, type, schedule_time, event_time, "
+                "event_ts, status, updated_at, recurrence) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, sender_id, info.get("task"), info.get("type"), info.get("schedule_time"),
+                     info.get("event_time"), to_timestamp(info.get("event_time")),
+                     info.get("status", "pending"), now,
+                     json.dumps(info["recurrence"]) if info.get("recurrence") else None)
+                    for job_id, info in tasks.items()
+                ],
+            )
+
+    def set_status(self, job_id, status, sender_id=None, delivery=None):
+        """
+        Update one task's status, and the notifier's delivery result if given.
+        With ``sender_id``, only if that user owns the task.
+        """
+        sql = "UPDATE tasks SET status = ?, updated_at = ?"
+        params = [status, time.time()]
+        if delivery is not None:
+            sql += ", delivery = ?"
+            params.append(json.dumps(delivery, default=str))
+        sql += " WHERE job_id = ?"
+        params.append(job_id)
+        if sender_id is not None:
+            sql += " AND sender_id = ?"
+            params.append(sender_id)
+        return self.db.execute(sql, params).rowcount > 0
+
+    def is_recurring(self, job_id):
+        """True / False for a known task, None if there is no such task."""
+        row = self.db.execute("SELECT recurrence FROM tasks WHERE job_id = ?", (job_id,)).fetchone()
+        return None if row is None else row["recurrence"] is not None
+
+    def record_occurrence(self, job_id, run_time, status, delivery=None, next_run=None):
+        """
+        Record one run of a recurring task. The task row moves on to ``next_run``
+        and stays pending; once the series has no next run it becomes completed.
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO occurrences (job_id, run_ts, status, delivery, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, run_time.timestamp(), status,
+                 json.dumps(delivery, default=str) if delivery is not None else None, now),
+            )
+            if next_run is not None:
+                conn.execute(
+                    "UPDATE tasks SET event_time = ?, event_ts = ?, updated_at = ?, delivery = ? "
+                    "WHERE job_id = ? AND status = 'pending'",
+                    (next_run.isoformat(), next_run.timestamp(), now,
+                     json.dumps(delivery, default=str) if delivery is not None else None, job_id),
+                )
+            else:
+                conn.execute(
+                    "UPDATE tasks SET status = 'completed', updated_at = ? WHERE job_id = ? AND status = 'pending'",
+                    (now, job_id),
+                )
+
+    def get_occurrences(self, job_id, limit=50):
+        """Most recent runs of a recurring task, newest first."""
+        rows = self.db.execute(
+            "SELECT run_ts, status, delivery FROM occurrences WHERE job_id = ? ORDER BY run_ts DESC LIMIT ?",
+            (job_id, limit),
+        )
+        return [
+            {"run_ts": row["run_ts"], "status": row["status"],
+             "delivery": json.loads(row["delivery"]) if row["delivery"] else None}
+            for row in rows
+        ]
+
+    def get_owner(self, job_id):
+        row = self.db.execute("SELECT sender_id FROM tasks WHERE job_id = ?", (job_id,)).fetchone()
+        return row["sender_id"] if row else None
+
+    def get_tasks(self, sender_id, status=None, include_archived=False):
+        sql = f"SELECT job_id, {', '.join(TASK_FIELDS)} FROM tasks WHERE sender_id = ?"
+        params = [sender_id]
+        if status is not None:
+            sql += " AND status = ?"
+            params.append(status)
+        sql += " ORDER BY event_ts"
+
+        tasks = {}
+        if include_archived:
+            for row in self.archive.execute(sql, params):
+                tasks[row["job_id"]] = {f: row[f] for f in TASK_FIELDS}
+        for row in self.db.execute(sql, params):
+            tasks[row["job_id"]] = {f: row[f] for f in TASK_FIELDS}
+        return tasks
+
+    def get_pending_tasks(self, sender_id):
+        # The literal status lets SQLite use the partial pending index
+        rows = self.db.execute(
+            f"SELECT job_id, {', '.join(TASK_FIELDS)} FROM tasks "
+            "WHERE sender_id = ? AND status = 'pending' ORDER BY event_ts",
+            (sender_id,),
+        )
+        return {row["job_id"]: {f: row[f] for f in TASK_FIELDS} for row in rows}
+
+    def count_pending_at(self, event_ts):
+        """Pending tasks due at exactly this instant (an index lookup on (status, event_ts))."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status = 'pending' AND event_ts = ?", (event_ts,)
+        ).fetchone()[0]
+
+    def get_tasks_by_status(self, status):
+        """``[(job_id, sender_id, info)]`` across all users."""
+        rows = self.db.execute(
+            f"SELECT job_id, sender_id, {', '.join(TASK_FIELDS)} FROM tasks WHERE status = ?", (status,)
+        )
+        return [(row["job_id"], row["sender_id"], {f: row[f] for f in TASK_FIELDS}) for row in rows]
+
+    def query_tasks(self, sender_id, status=None, task_type=None, since=None, until=None, sort="event_time",
+                    descending=False, limit=50, cursor=None, archived=False):
+        """
+        One page of a sender's tasks from the live table (or the archive), with
+        optional status / type / event-time filters. Pages are keyset-paginated
+        on (sort column, job_id), so each page is an index range scan however
+        deep the caller has paged. Returns ``{"tasks": [...], "next_cursor": str | None}``.
+        """
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"sort must be one of {sorted(SORT_COLUMNS)}")
+
+        where = ["sender_id = ?"]
+        params = [sender_id]
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if task_type is not None:
+            where.append("type = ?")
+            params.append(task_type)
+        if since is not None:
+            where.append("event_ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("event_ts < ?")
+            params.append(until)
+        if cursor is not None:
+            where.append(f"({column}, job_id) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        direction = "DESC" if descending else "ASC"
+        rows = (self.archive if archived else self.db).execute(
+            f"SELECT job_id, {column} AS sort_value, {', '.join(TASK_FIELDS)}, delivery FROM tasks "
+            f"WHERE {' AND '.join(where)} ORDER BY {column} {direction}, job_id {direction} LIMIT ?",
+            params + [limit + 1],
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["sort_value"], rows[-1]["job_id"])
+        return {
+            "tasks": [
+                {"id": row["job_id"], **{f: row[f] for f in TASK_FIELDS},
+                 "delivery": json.loads(row["delivery"]) if row["delivery"] else None}
+                for row in rows
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    def list_senders(self):
+        return [row["sender_id"] for row in self.db.execute("SELECT sender_id FROM senders ORDER BY sender_id")]
+
+    def senders_version(self):
+        """Changes whenever a new sender is added; cheap enough to check on every request."""
+        return self.db.execute("SELECT MAX(rowid) FROM senders").fetchone()[0]
+
+    def archive_finished(self, before, batch_size=500):
+        """
+        Move tasks that are no longer pending and were last updated before the
+        ``before`` timestamp into the archive, in batches. Rows are written to
+        the archive before they are deleted here, so an interrupted run only
+        leaves duplicates that the next run overwrites.
+        """
+        columns = ", ".join(self.ARCHIVE_COLUMNS)
+        placeholders = ", ".join("?" for _ in self.ARCHIVE_COLUMNS)
+        archived = 0
+        while True:
+            rows = self.db.execute(
+                f"SELECT {columns} FROM tasks WHERE status != 'pending' AND updated_at < ? LIMIT ?",
+                (before, batch_size),
+            ).fetchall()
+            if not rows:
+                return archived
+
+            now = time.time()
+            with self.archive.transaction() as conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO tasks ({columns}, archived_at) VALUES ({placeholders}, ?)",
+                    [(*tuple(row), now) for row in rows],
+                )
+            with self.db.transaction() as conn:
+                conn.executemany(
+                    "DELETE FROM tasks WHERE job_id = ? AND status != 'pending' AND updated_at < ?",
+                    [(row["job_id"], before) for row in rows],
+                )
+            archived += len(rows)
+
+    def purge_occurrences(self, before):
+        return self.db.execute("DELETE FROM occurrences WHERE updated_at < ?", (before,)).rowcount
+
+    def purge_archive(self, before):
+        return self.archive.execute("DELETE FROM tasks WHERE archived_at < ?", (before,)).rowcount
+
+    def _sample_pending_lookup_ms(self, senders):
+        if not senders:
+            return None
+        started = time.perf_counter()
+        for sender_id in senders:
+            self.get_pending_tasks(sender_id)
+        return round((time.perf_counter() - started) * 1000 / len(senders), 3)
+
+    def compact(self, retention_days=TASK_RETENTION_DAYS, archive_retention_days=TASK_ARCHIVE_RETENTION_DAYS,
+                sample_size=50):
+        """
+        Archive finished tasks older than ``retention_days``, drop recurring-task
+        run history of the same age, purge the archive past
+        ``archive_retention_days`` (0 keeps it), give freed pages back to
+        the filesystem, and report rows moved, bytes reclaimed and the average
+        pending-task lookup time for a sample of users before and after.
+        """
+        senders = [row["sender_id"] for row in self.db.execute(
+            "SELECT DISTINCT sender_id FROM tasks WHERE status = 'pending' LIMIT ?", (sample_size,)
+        )]
+        bytes_before = db_size(self.db)
+        lookup_ms_before = self._sample_pending_lookup_ms(senders)
+
+        now = time.time()
+        archived = self.archive_finished(now - retention_days * 86400)
+        occurrences_purged = self.purge_occurrences(now - retention_days * 86400)
+        purged = self.purge_archive(now - archive_retention_days * 86400) if archive_retention_days else 0
+
+        for db in (self.db, self.archive):
+            conn = db.connect()
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                # One full rebuild switches the file to incremental auto-vacuum
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            conn.execute("PRAGMA incremental_vacuum")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute("ANALYZE")
+
+        bytes_after = db_size(self.db)
+        report = {
+            "archived": archived,
+            "purged": purged,
+            "occurrences_purged": occurrences_purged,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            "reclaimed_bytes": bytes_before - bytes_after,
+            "lookup_ms_before": lookup_ms_before,
+            "lookup_ms_after": self._sample_pending_lookup_ms(senders),
+            "duration_s": round(time.time() - now, 3),
+        }
+
+        metrics.inc("tasks_archived_total", archived)
+        metrics.inc("task_store_reclaimed_bytes_total", max(report["reclaimed_bytes"], 0))
+        metrics.set_gauge("task_store_bytes", bytes_after)
+        return report
+
+    def migrate_from_status_cache(self, base_path="status_cache"):
+        """
+        One-shot import of the legacy per-user ``status_cache/<wa_id>`` diskcache
+        directories. Runs under the write lock and records a marker, so only one
+        process ever imports. The old directories are left in place.
+        """
+        if not os.path.isdir(base_path):
+            return 0
+
+        import diskcache
+
+        with self.db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'status_cache_migrated'").fetchone():
+                return 0
+
+            migrated = 0
+            now = time.time()
+            for sender_id in os.listdir(base_path):
+                user_path = os.path.join(base_path, sender_id)
+                if not os.path.isdir(user_path):
+                    continue
+                with diskcache.Cache(user_path) as status_cache:
+                    status_data = status_cache.get("status", {})
+                for job_id, info in status_data.items():
+                    conn.execute(
+                        "INSERT OR IGNORE INTO tasks (job_id, sender_id, task, type, schedule_time, event_time, "
+                        "event_ts, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (job_id, sender_id, info.get("task"), info.get("type"), info.get("schedule_time"),
+                         info.get("event_time"), to_timestamp(info.get("event_time")),
+                         info.get("status", "pending"), now),
+                    )
+                    migrated += 1
+
+            conn.execute("INSERT OR IGNORE INTO senders (sender_id, created_at) SELECT DISTINCT sender_id, ? FROM tasks", (now,))
+            conn.execute("INSERT INTO meta (key, value) VALUES ('status_cache_migrated', ?)", (str(now),))
+
+        logging.info(f"📦 Migrated {migrated} tasks from {base_path}/ into the task store")
+        return migrated
+
+
+task_store = TaskStore(
+    os.getenv("TASK_DB_PATH", "tasks.sqlite3"),
+    os.getenv("TASK_ARCHIVE_PATH", "tasks_archive.sqlite3"),
+)
+task_store.migrate_from_status_cache()
@@ -0,0 +1,283 @@
+import glob
+import logging
+import os
+import shelve
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from app.utils.db import SQLiteDB
+from app.utils import metrics
+
+
+class ThreadStore(ABC):
+    """
+    Maps a WhatsApp ID to the OpenAI thread that holds the user's conversation,
+    along with per-user settings such as a timezone override. Backends must
+    implement every method; a missing one fails when the store is constructed.
+    """
+
+    @abstractmethod
+    def get(self, wa_id):
+        """The user's current thread ID, or None."""
+
+    @abstractmethod
+    def set(self, wa_id, thread_id):
+        """Store the user's thread ID."""
+
+    @abstractmethod
+    def get_timezone(self, wa_id):
+        """The user's stored timezone override, or None."""
+
+    @abstractmethod
+    def set_timezone(self, wa_id, timezone):
+        """Store a timezone override for the user."""
+
+    @abstractmethod
+    def record_usage(self, wa_id, prompt_tokens, completion_tokens):
+        """Add one run's token usage to the user's totals and count the turn."""
+
+    @abstractmethod
+    def get_context_stats(self, wa_id):
+        """``{"turns", "last_prompt_tokens", ...}`` for the user's current thread, or None."""
+
+    @abstractmethod
+    def rotate_thread(self, wa_id, thread_id, summary):
+        """Switch the user to a new thread that starts from ``summary``."""
+
+    @abstractmethod
+    def get_summary(self, wa_id):
+        """Summary of the conversation before the user's current thread, or None."""
+
+
+class SQLiteThreadStore(ThreadStore):
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS threads (
+        wa_id TEXT PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        timezone TEXT,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        turns INTEGER NOT NULL DEFAULT 0,
+        last_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        rotations INTEGER NOT NULL DEFAULT 0,
+        summary TEXT
+    );
+    """
+    COLUMNS = {"threads": {
+        "timezone": "TEXT",
+        "prompt_tokens": "INTEGER NOT NULL DEFAULT 0",
+        "completion_tokens": "INTEGER NOT NULL DEFAULT 0",
+        "turns": "INTEGER NOT NULL DEFAULT 0",
+        "last_prompt_tokens": "INTEGER NOT NULL DEFAULT 0",
+        "rotations": "INTEGER NOT NULL DEFAULT 0",
+        "summary": "TEXT",
+    }}
+    CONTEXT_FIELDS = ["prompt_tokens", "completion_tokens", "turns", "last_prompt_tokens", "rotations"]
+
+    def __init__(self, path="threads.sqlite3"):
+        self.db = SQLiteDB(path, self.SCHEMA, self.COLUMNS)
+
+    def get(self, wa_id):
+        row = self.db.execute("SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        # An empty thread_id marks a user that only has settings so far
+        return (row["thread_id"] or None) if row else None
+
+    def set(self, wa_id, thread_id):
+        self.db.execute(
+            "INSERT INTO threads (wa_id, thread_id, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(wa_id) DO UPDATE SET thread_id = excluded.thread_id, updated_at = excluded.updated_at",
+            (wa_id, thread_id, time.time()),
+        )
+
+    def get_timezone(self, wa_id):
+        row = self.db.execute("SELECT timezone FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        return row["timezone"] if row else None
+
+    def set_timezone(self, wa_id, timezone):
+        self.db.execute(
+            "INSERT INTO threads (wa_id, thread_id, updated_at, timezone) VALUES (?, '', ?, ?) "
+            "ON CONFLICT(wa_id) DO UPDATE SET timezone = excluded.timezone, updated_at = excluded.updated_at",
+            (wa_id, time.time(), timezone),
+        )
+
+    def record_usage(self, wa_id, prompt_tokens, completion_tokens):
+        self.db.execute(
+            "UPDATE threads SET prompt_tokens = prompt_tokens + ?, completion_tokens = completion_tokens + ?, "
+            "turns = turns + 1, last_prompt_tokens = ? WHERE wa_id = ?",
+            (prompt_tokens, completion_tokens, prompt_tokens, wa_id),
+        )
+
+    def get_context_stats(self, wa_id):
+        row = self.db.execute(
+            f"SELECT {', '.join(self.CONTEXT_FIELDS)} FROM threads WHERE wa_id = ?", (wa_id,)
+        ).fetchone()
+        return {field: row[field] for field in self.CONTEXT_FIELDS} if row else None
+
+    def rotate_thread(self, wa_id, thread_id, summary):
+        self.db.execute(
+            "UPDATE threads SET thread_id = ?, summary = ?, turns = 0, last_prompt_tokens = 0, "
+            "rotations = rotations + 1, updated_at = ? WHERE wa_id = ?",
+            (thread_id, summary, time.time(), wa_id),
+        )
+
+    def get_summary(self, wa_id):
+        row = self.db.execute("SELECT summary FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        return row["summary"] if row else None
+
+
+class RedisThreadStore(ThreadStore):
+    """Optional backend for deployments that span several hosts (needs the ``redis`` package)."""
+
+    def __init__(self, url, prefix="whatsapp:user:"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def get(self, wa_id):
+        return self.redis.hget(self.prefix + wa_id, "thread_id")
+
+    def set(self, wa_id, thread_id):
+        self.redis.hset(self.prefix + wa_id, "thread_id", thread_id)
+
+    def get_timezone(self, wa_id):
+        return self.redis.hget(self.prefix + wa_id, "timezone")
+
+    def set_timezone(self, wa_id, timezone):
+        self.redis.hset(self.prefix + wa_id, "timezone", timezone)
+
+    def record_usage(self, wa_id, prompt_tokens, completion_tokens):
+        key = self.prefix + wa_id
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, "prompt_tokens", prompt_tokens)
+        pipe.hincrby(key, "completion_tokens", completion_tokens)
+        pipe.hincrby(key, "turns", 1)
+        pipe.hset(key, "last_prompt_tokens", prompt_tokens)
+        pipe.execute()
+
+    def get_context_stats(self, wa_id):
+        fields = SQLiteThreadStore.CONTEXT_FIELDS
+        values = self.redis.hmget(self.prefix + wa_id, fields)
+        return {field: int(value or 0) for field, value in zip(fields, values)}
+
+    def rotate_thread(self, wa_id, thread_id, summary):
+        key = self.prefix + wa_id
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={"thread_id": thread_id, "summary": summary, "turns": 0, "last_prompt_tokens": 0})
+        pipe.hincrby(key, "rotations", 1)
+        pipe.execute()
+
+    def get_summary(self, wa_id):
+        return self.redis.hget(self.prefix + wa_id, "summary")
+
+
+class CachedThreadStore(ThreadStore):
+    """
+    Read-through LRU cache in front of a durable store. Entries expire after
+    ``ttl`` seconds so a value changed by another process is picked up. Thread
+    IDs are not cached: another process may rotate the thread at any time, and
+    running on a stale one would lose the conversation.
+    """
+
+    def __init__(self, backend, capacity=10000, ttl=300):
+        self.backend = backend
+        self.capacity = capacity
+        self.ttl = ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, wa_id):
+        return self.backend.get(wa_id)
+
+    def set(self, wa_id, thread_id):
+        self.backend.set(wa_id, thread_id)
+
+    def get_timezone(self, wa_id):
+        return self._read("timezone", wa_id, self.backend.get_timezone)
+
+    def set_timezone(self, wa_id, timezone):
+        self.backend.set_timezone(wa_id, timezone)
+        self._remember(("timezone", wa_id), timezone)
+
+    def record_usage(self, wa_id, prompt_tokens, completion_tokens):
+        self.backend.record_usage(wa_id, prompt_tokens, completion_tokens)
+
+    def get_context_stats(self, wa_id):
+        # Counters change every turn: always read them from the backend
+        return self.backend.get_context_stats(wa_id)
+
+    def rotate_thread(self, wa_id, thread_id, summary):
+        self.backend.rotate_thread(wa_id, thread_id, summary)
+        self._remember(("summary", wa_id), summary)
+
+    def get_summary(self, wa_id):
+        return self._read("summary", wa_id, self.backend.get_summary)
+
+    def _read(self, field, wa_id, loader):
+        key = (field, wa_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(key)
+                metrics.inc("thread_cache_hits_total", field=field)
+                return entry[0]
+
+        metrics.inc("thread_cache_misses_total", field=field)
+        value = loader(wa_id)
+        self._remember(key, value)
+        return value
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._cache[key] = (value, time.monotonic() + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+
+def create_thread_store():
+    """Build the store configured by THREAD_STORE_URL (sqlite:///<path> or redis://...)."""
+    url = os.getenv("THREAD_STORE_URL", "sqlite:///threads.sqlite3")
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        backend = RedisThreadStore(url)
+    else:
+        backend = SQLiteThreadStore(url[len("sqlite:///"):] if url.startswith("sqlite:///") else url)
+
+    return CachedThreadStore(
+        backend,
+        capacity=int(os.getenv("THREAD_CACHE_SIZE", "10000")),
+        ttl=float(os.getenv("THREAD_CACHE_TTL", "300")),
+    )
+
+
+def migrate_from_shelve(store, path="threads_db"):
+    """
+    One-shot import of the legacy ``threads_db`` shelve file. The shelve files are
+    renamed to ``*.migrated`` afterwards so the import does not run again.
+    """
+    files = [f for f in glob.glob(path + "*") if not f.endswith(".migrated")]
+    if not files:
+        return 0
+
+    migrated = 0
+    try:
+        with shelve.open(path, flag="r") as threads_shelf:
+            for wa_id, thread_id in threads_shelf.items():
+                if store.get(wa_id) is None:
+                    store.set(wa_id, thread_id)
+                    migrated += 1
+    except Exception as e:
+        logging.error(f"❌ Failed to migrate {path}: {e}")
+        return 0
+
+    for f in files:
+        try:
+            os.replace(f, f + ".migrated")
+        except OSError:
+            # Another worker migrated concurrently
+            pass
+    logging.info(f"📦 Migrated {migrated} threads from {path}")
+    return migrated
@@ -0,0 +1,89 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from app.utils import metrics
+
+
+def plan_stages(tool_calls, registry):
+    """
+    Split tool calls into stages that can each run concurrently.
+
+    Consecutive calls of the same kind ("read" or "write") share a stage, and a
+    change of kind starts a new one. A read that the model placed after a write
+    (e.g. ``delete_task`` then ``get_pending_tasks``) therefore sees the write.
+    """
+    stages = []
+    last_kind = None
+    for call in tool_calls:
+        kind = registry.get(call.function.name, {}).get("kind", "write")
+        if kind != last_kind:
+            stages.append([])
+            last_kind = kind
+        stages[-1].append(call)
+    return stages
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of one ``requires_action`` step on a shared thread pool.
+
+    ``registry`` maps a tool name to ``{"fn": fn(wa_id, arguments), "kind": "read" | "write",
+    "timeout": seconds}``. Outputs are returned in the order of ``tool_calls``.
+
+    Calls within a stage run concurrently; each write touches its own rows
+    atomically, so a stage of writes is as safe in parallel as in order. A
+    call that times out cannot be stopped and may still be running, so no
+    later stage is started: its calls get an error output instead of racing it.
+    """
+
+    def __init__(self, registry, max_workers=8, timeout=15.0):
+        self.registry = registry
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def execute(self, wa_id, tool_calls):
+        results = {}
+        timed_out = None
+
+        for stage in plan_stages(tool_calls, self.registry):
+            if timed_out is not None:
+                for call in stage:
+                    metrics.inc("tool_skipped_total", tool=call.function.name)
+                    results[call.id] = {"error": f"{call.function.name} not run: {timed_out} timed out"}
+                continue
+
+            started = time.monotonic()
+            futures = [(call, self.pool.submit(self._invoke, wa_id, call)) for call in stage]
+
+            for call, future in futures:
+                timeout = self.registry.get(call.function.name, {}).get("timeout", self.timeout)
+                try:
+                    results[call.id] = future.result(timeout=max(0.0, started + timeout - time.monotonic()))
+                except FuturesTimeout:
+                    metrics.inc("tool_timeouts_total", tool=call.function.name)
+                    logging.error(f"⏰ Tool {call.function.name} timed out after {timeout}s")
+                    results[call.id] = {"error": f"{call.function.name} timed out"}
+                    timed_out = call.function.name
+
+        return [
+            {"tool_call_id": call.id, "output": json.dumps(results[call.id])}
+            for call in tool_calls
+        ]
+
+    def _invoke(self, wa_id, call):
+        fn_name = call.function.name
+        spec = self.registry.get(fn_name)
+        if spec is None:
+            return {"error": f"Unknown function: {fn_name}"}
+
+        started = time.perf_counter()
+        try:
+            arguments = json.loads(call.function.arguments or "{}")
+            return spec["fn"](wa_id, arguments)
+        except Exception as e:
+            metrics.inc("tool_errors_total", tool=fn_name)
+            logging.exception(f"💥 Tool {fn_name} failed")
+            return {"error": str(e)}
+        finally:
+            metrics.observe("tool_latency_seconds", time.perf_counter() - started, tool=fn_name)
@@ -0,0 +1,144 @@
+import logging
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.utils import metrics
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "1"))
+TRANSCRIBE_QUEUE_SIZE = int(os.getenv("TRANSCRIBE_QUEUE_SIZE", "4"))
+# How long a caller waits for a free slot before the request is rejected
+TRANSCRIBE_QUEUE_TIMEOUT = float(os.getenv("TRANSCRIBE_QUEUE_TIMEOUT", "30"))
+TRANSCRIBE_TIMEOUT = float(os.getenv("TRANSCRIBE_TIMEOUT", "300"))
+# Workers are started from a fresh interpreter, never forked from the web worker:
+# it already runs threads (webhook pool, scheduler, outbound queue, SMTP), and a
+# fork copies any lock one of them holds at that moment, which can deadlock the child
+TRANSCRIBE_START_METHOD = os.getenv(
+    "TRANSCRIBE_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn",
+)
+
+
+class TranscriberBusy(Exception):
+    """Raised when every worker is busy and the transcription queue is full."""
+
+
+# Set in each worker process by _load_model
+_model = None
+
+
+def _load_model(model_size):
+    global _model
+    import whisper
+
+    started = time.perf_counter()
+    _model = whisper.load_model(model_size)
+    logging.info(f"🧠 Loaded Whisper '{model_size}' in pid {os.getpid()} in {time.perf_counter() - started:.1f}s")
+
+
+def decode_audio(data, sample_rate=16000):
+    """
+    Decode compressed audio bytes (e.g. WhatsApp's OGG/Opus) into the mono
+    16 kHz float32 array Whisper consumes, piping through ffmpeg without
+    touching the filesystem.
+    """
+    import numpy as np
+
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+    try:
+        out = subprocess.run(cmd, input=data, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to decode audio: {e.stderr.decode(errors='ignore')}") from e
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+def _transcribe(data):
+    started = time.perf_counter()
+    audio = decode_audio(data)
+    decoded = time.perf_counter()
+    result = _model.transcribe(audio, task="translate")
+    return {
+        "text": result["text"],
+        "timings": {
+            "decode": decoded - started,
+            "transcribe": time.perf_counter() - decoded,
+        },
+    }
+
+
+class Transcriber:
+    """
+    Whisper transcription on a lazily started process pool.
+
+    Nothing is imported or loaded until the first voice note arrives; each worker
+    process then loads the model once. At most ``workers + queue_size`` requests
+    are in flight. Further callers wait up to ``queue_timeout`` seconds for a slot
+    and then get ``TranscriberBusy``, so a voice burst pushes back on the webhook
+    queue instead of piling up.
+    """
+
+    def __init__(self, model_size=WHISPER_MODEL, workers=TRANSCRIBE_WORKERS,
+                 queue_size=TRANSCRIBE_QUEUE_SIZE, queue_timeout=TRANSCRIBE_QUEUE_TIMEOUT,
+                 timeout=TRANSCRIBE_TIMEOUT, start_method=TRANSCRIBE_START_METHOD):
+        self.model_size = model_size
+        self.workers = workers
+        self.start_method = start_method
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._in_flight = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("transcription_in_flight", lambda: self._in_flight)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                logging.info(f"🎙️ Starting {self.workers} transcription worker(s) ({self.model_size})")
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_load_model,
+                    initargs=(self.model_size,),
+                )
+            return self._pool
+
+    def transcribe(self, data):
+        """
+        Transcribe compressed audio bytes. Returns ``{"text": ..., "timings": {...}}``
+        with the decode and transcribe times measured in the worker.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            metrics.inc("transcription_rejected_total")
+            raise TranscriberBusy(f"{self._in_flight} transcriptions already in flight")
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            pool = self._get_pool()
+            with metrics.timer("transcription_seconds"):
+                return pool.submit(_transcribe, data).result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool for the next voice note
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            pool.shutdown(wait=False)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+
+transcriber = Transcriber()
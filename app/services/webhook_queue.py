@@ -0,0 +1,159 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from app.utils import metrics
+
+
+class WebhookQueue:
+    """
+    Bounded job queue drained by a pool of worker threads, so the webhook can
+    acknowledge Meta immediately and do the slow work (Whisper, OpenAI runs,
+    outbound sends) in the background.
+
+    Any object implementing the ``queue.Queue`` interface (``put_nowait``,
+    ``get``, ``task_done``, ``qsize``) can be passed as ``backend``.
+    """
+
+    def __init__(self, app, workers=4, maxsize=100, backend=None):
+        self.app = app
+        self.workers = workers
+        self.queue = backend if backend is not None else queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._busy = 0
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("webhook_queue_depth", self.queue.qsize)
+        metrics.register_gauge("webhook_workers_busy", lambda: self._busy)
+        metrics.register_gauge("webhook_worker_utilization", self.utilization)
+
+    def start(self):
+        # Threads are started lazily so that forked gunicorn workers get their own pool
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        logging.info(f"🧵 Started {self.workers} webhook workers")
+
+    def submit(self, fn, *args):
+        """Enqueue ``fn(*args)``. Returns False when the queue is full."""
+        self.start()
+        try:
+            self.queue.put_nowait((time.monotonic(), fn, args))
+        except queue.Full:
+            metrics.inc("webhook_queue_rejected_total")
+            return False
+        metrics.inc("webhook_queue_enqueued_total")
+        return True
+
+    def utilization(self):
+        return self._busy / self.workers if self.workers else 0.0
+
+    def _worker(self):
+        while True:
+            enqueued_at, fn, args = self.queue.get()
+            started_at = time.monotonic()
+            metrics.observe("webhook_queue_wait_seconds", started_at - enqueued_at)
+
+            with self._lock:
+                self._busy += 1
+            try:
+                with self.app.app_context():
+                    fn(*args)
+            except Exception:
+                metrics.inc("webhook_jobs_failed_total")
+                logging.exception("💥 Unhandled error in webhook worker")
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                metrics.observe("webhook_job_seconds", time.monotonic() - started_at)
+                self.queue.task_done()
+
+
+class UserDispatcher:
+    """
+    Per-``wa_id`` serialized dispatch on top of a ``WebhookQueue``.
+
+    Messages from the same user are handled strictly in arrival order by at most
+    one worker at a time, while different users are processed in parallel. When
+    ``coalesce`` is on, messages that pile up while a user's turn is in flight
+    are handed to ``handler`` together so they become a single assistant run.
+
+    Meta has already been acknowledged by the time a lane is drained, so a
+    batch that fails is not redelivered; ``on_failure(wa_id, items)`` is called
+    instead so the user can at least be told.
+    """
+
+    def __init__(self, pool, handler, coalesce=True, max_pending=20, on_failure=None):
+        self.pool = pool
+        self.handler = handler
+        self.on_failure = on_failure
+        self.coalesce = coalesce
+        self.max_pending = max_pending
+        self._lanes = {}
+        self._inline_locks = {}
+        self._lock = threading.Lock()
+
+        metrics.register_gauge("dispatcher_active_users", lambda: len(self._lanes))
+
+    def dispatch(self, wa_id, items):
+        """
+        Queue ``items`` (a burst from one user, in order) on the user's lane.
+        Returns False when they can't be accepted.
+        """
+        with self._lock:
+            lane = self._lanes.get(wa_id)
+            if lane is not None:
+                # A worker is already draining this user's lane and will pick them up
+                if len(lane) + len(items) > self.max_pending:
+                    metrics.inc("dispatcher_rejected_total")
+                    return False
+                lane.extend(items)
+                return True
+
+            self._lanes[wa_id] = deque(items)
+            if not self.pool.submit(self._drain, wa_id):
+                del self._lanes[wa_id]
+                return False
+        return True
+
+    def run_inline(self, wa_id, items):
+        """Synchronous variant used when the webhook runs in "sync" mode."""
+        with self._lock:
+            user_lock = self._inline_locks.setdefault(wa_id, threading.Lock())
+        with user_lock:
+            return self.handler(wa_id, items)
+
+    def _drain(self, wa_id):
+        while True:
+            with self._lock:
+                lane = self._lanes[wa_id]
+                if not lane:
+                    del self._lanes[wa_id]
+                    return
+                if self.coalesce:
+                    items = list(lane)
+                    lane.clear()
+                else:
+                    items = [lane.popleft()]
+
+            if len(items) > 1:
+                metrics.inc("dispatcher_coalesced_messages_total", len(items) - 1)
+            try:
+                self.handler(wa_id, items)
+            except Exception:
+                metrics.inc("dispatcher_failed_total")
+                logging.exception(f"💥 Failed to process messages for {wa_id}")
+                self._notify_failure(wa_id, items)
+
+    def _notify_failure(self, wa_id, items):
+        if self.on_failure is None:
+            return
+        try:
+            self.on_failure(wa_id, items)
+        except Exception:
+            logging.exception(f"💥 Could not notify {wa_id} of the failure")
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteDB:
+    """
+    Lazily opened, per-thread SQLite connections in WAL mode.
+
+    WAL lets readers in any process run alongside a single writer, and the busy
+    timeout makes concurrent writers from several gunicorn workers wait instead
+    of failing. Connections are reopened after a fork.
+    """
+
+    def __init__(self, path, schema="", columns=None):
+        self.path = path
+        self.schema = schema
+        # {table: {column: declaration}} added to databases created by older versions
+        self.columns = columns or {}
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.executescript(self.schema)
+                for table, columns in self.columns.items():
+                    existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                    for column, declaration in columns.items():
+                        if column not in existing:
+                            try:
+                                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+                            except sqlite3.OperationalError as e:
+                                # Another process added it first
+                                if "duplicate column" not in str(e):
+                                    raise
+                self._schema_ready = True
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.connect().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction that takes the database write lock up front."""
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,99 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Process-wide, thread-safe metrics registry exposed on GET /metrics
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_gauge_callbacks = {}
+_histograms = {}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def register_gauge(name, callback, **labels):
+    """Register a callable that is evaluated every time a snapshot is taken."""
+    with _lock:
+        _gauge_callbacks[_key(name, labels)] = callback
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {
+                "count": 0,
+                "sum": 0.0,
+                "max": 0.0,
+                "buckets": {b: 0 for b in buckets},
+            }
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["max"] = max(hist["max"], value)
+        for bound in hist["buckets"]:
+            if value <= bound:
+                hist["buckets"][bound] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _quantile(hist, q):
+    # Upper bound of the first bucket that covers the requested quantile
+    target = hist["count"] * q
+    for bound, count in hist["buckets"].items():
+        if count >= target:
+            return bound
+    return hist["max"]
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        callbacks = dict(_gauge_callbacks)
+        histograms = {
+            key: {
+                "count": h["count"],
+                "sum": round(h["sum"], 6),
+                "avg": round(h["sum"] / h["count"], 6) if h["count"] else 0.0,
+                "p50": _quantile(h, 0.5),
+                "p99": _quantile(h, 0.99),
+                "max": round(h["max"], 6),
+            }
+            for key, h in _histograms.items()
+        }
+
+    for key, callback in callbacks.items():
+        try:
+            gauges[key] = callback()
+        except Exception as e:
+            gauges[key] = f"error: {e}"
+
+    return {"counters": counters, "gauges": gauges, "histograms": histograms}
@@ -1,10 +1,50 @@
+import os
+import re
 import pytz
 import requests
 from datetime import datetime
+from functools import lru_cache
+
+# Fallback when a WhatsApp ID's calling code is not in the table below
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Asia/Kolkata")
+
+# Representative zone per country calling code (the prefix of a WhatsApp ID).
+# Countries spanning several zones get their most populous one; users there
+# can store an override with their thread.
+CALLING_CODE_TIMEZONES = {
+    "1": "America/New_York", "7": "Europe/Moscow", "20": "Africa/Cairo",
+    "27": "Africa/Johannesburg", "30": "Europe/Athens", "31": "Europe/Amsterdam",
+    "32": "Europe/Brussels", "33": "Europe/Paris", "34": "Europe/Madrid",
+    "36": "Europe/Budapest", "39": "Europe/Rome", "40": "Europe/Bucharest",
+    "41": "Europe/Zurich", "43": "Europe/Vienna", "44": "Europe/London",
+    "45": "Europe/Copenhagen", "46": "Europe/Stockholm", "47": "Europe/Oslo",
+    "48": "Europe/Warsaw", "49": "Europe/Berlin", "51": "America/Lima",
+    "52": "America/Mexico_City", "54": "America/Argentina/Buenos_Aires",
+    "55": "America/Sao_Paulo", "56": "America/Santiago", "57": "America/Bogota",
+    "58": "America/Caracas", "60": "Asia/Kuala_Lumpur", "61": "Australia/Sydney",
+    "62": "Asia/Jakarta", "63": "Asia/Manila", "64": "Pacific/Auckland",
+    "65": "Asia/Singapore", "66": "Asia/Bangkok", "81": "Asia/Tokyo",
+    "82": "Asia/Seoul", "84": "Asia/Ho_Chi_Minh", "86": "Asia/Shanghai",
+    "90": "Europe/Istanbul", "91": "Asia/Kolkata", "92": "Asia/Karachi",
+    "93": "Asia/Kabul", "94": "Asia/Colombo", "95": "Asia/Yangon",
+    "98": "Asia/Tehran", "212": "Africa/Casablanca", "213": "Africa/Algiers",
+    "216": "Africa/Tunis", "233": "Africa/Accra", "234": "Africa/Lagos",
+    "251": "Africa/Addis_Ababa", "254": "Africa/Nairobi", "255": "Africa/Dar_es_Salaam",
+    "256": "Africa/Kampala", "351": "Europe/Lisbon", "353": "Europe/Dublin",
+    "358": "Europe/Helsinki", "380": "Europe/Kiev", "420": "Europe/Prague",
+    "852": "Asia/Hong_Kong", "880": "Asia/Dhaka", "886": "Asia/Taipei",
+    "960": "Indian/Maldives", "961": "Asia/Beirut", "962": "Asia/Amman",
+    "964": "Asia/Baghdad", "965": "Asia/Kuwait", "966": "Asia/Riyadh",
+    "968": "Asia/Muscat", "971": "Asia/Dubai", "972": "Asia/Jerusalem",
+    "973": "Asia/Bahrain", "974": "Asia/Qatar", "975": "Asia/Thimphu",
+    "977": "Asia/Kathmandu",
+}
+
 
 def get_location_from_ip():
+    """Location of *this server* from ipinfo.io. Not used on the message path any more."""
     try:
-        response = requests.get('https://ipinfo.io/json')
+        response = requests.get('https://ipinfo.io/json', timeout=5)
         response.raise_for_status()
         data = response.json()
 
@@ -22,13 +62,41 @@ def get_location_from_ip():
         return {"error": str(e)}
 
 
+@lru_cache(maxsize=None)
+def get_zone(timezone: str):
+    """Process-wide cache of resolved pytz zones (raises for unknown names)."""
+    return pytz.timezone(timezone)
+
+
+@lru_cache(maxsize=65536)
+def timezone_from_wa_id(wa_id: str):
+    """Guess a user's timezone from the country calling code of their WhatsApp ID."""
+    digits = re.sub(r"\D", "", wa_id)
+    for length in (3, 2, 1):
+        timezone = CALLING_CODE_TIMEZONES.get(digits[:length])
+        if timezone:
+            return timezone
+    return DEFAULT_TIMEZONE
+
+
+def resolve_user_timezone(wa_id: str, override: str = None):
+    """The user's stored override if it is a valid zone, else the calling-code guess."""
+    if override:
+        try:
+            get_zone(override)
+            return override
+        except pytz.UnknownTimeZoneError:
+            pass
+    return timezone_from_wa_id(wa_id)
+
+
 def get_current_datetime_by_timezone(timezone: str):
     try:
-        tz = pytz.timezone(timezone)
+        tz = get_zone(timezone)
         now = datetime.now(tz)
         return {
             "timezone": timezone,
             "current_time": now.isoformat()
         }
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
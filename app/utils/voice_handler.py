@@ -1,44 +1,134 @@
 import os
+import time
+import hashlib
 import requests
 import logging
-import whisper
-from flask import current_app
+import diskcache
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from app.services.graph_client import get_graph_client
+from app.services.transcriber import transcriber, TranscriberBusy
+from app.utils import metrics
+
+# Voice notes larger than this are refused rather than buffered
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(16 * 1024 * 1024)))
+MEDIA_TIMEOUT = float(os.getenv("MEDIA_TIMEOUT", "10"))
+CHUNK_SIZE = 64 * 1024
+
+# Transcripts keyed by media ID and by a hash of the audio, so redelivered webhooks
+# and forwarded voice notes skip Whisper entirely
+transcript_cache = diskcache.Cache(
+    "transcript_cache",
+    size_limit=int(os.getenv("TRANSCRIPT_CACHE_BYTES", str(64 * 1024 * 1024))),
+    eviction_policy="least-recently-used",
+)
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+class AudioTooLarge(Exception):
+    pass
 
-whisper_model = whisper.load_model("base")
 
 def get_media_url(media_id):
-    version = current_app.config["VERSION"]
-    access_token = current_app.config["ACCESS_TOKEN"]
-    url = f"https://graph.facebook.com/{version}/{media_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    graph = get_graph_client()
+    response = graph.get(f"{graph.base_url}/{media_id}", endpoint="media", timeout=MEDIA_TIMEOUT)
     return response.json().get("url")
 
-def download_audio(media_url, media_id):
-    headers = {"Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}"}
-    response = requests.get(media_url, headers=headers)
-    
-    tmp_dir = os.path.join(os.getcwd(), "tmp")
-    os.makedirs(tmp_dir, exist_ok=True)
+def download_audio(media_url):
+    """Stream the media into memory in chunks, enforcing MAX_AUDIO_BYTES."""
+    graph = get_graph_client()
+    with graph.get(media_url, endpoint="media_download", stream=True, timeout=MEDIA_TIMEOUT) as response:
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length") or 0) > MAX_AUDIO_BYTES:
+            raise AudioTooLarge(f"Voice note is {response.headers['Content-Length']} bytes")
+
+        data = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            data.extend(chunk)
+            if len(data) > MAX_AUDIO_BYTES:
+                raise AudioTooLarge(f"Voice note exceeds {MAX_AUDIO_BYTES} bytes")
 
-    filepath = os.path.join(tmp_dir, f"voice_{media_id}.ogg")
-    with open(filepath, "wb") as f:
-        f.write(response.content)
+    logging.info(f"✅ Downloaded {len(data)} bytes of audio")
+    return bytes(data)
 
-    logging.info(f"✅ Saved audio to: {filepath}")
-    return filepath
+def get_cached_transcript(key, key_type):
+    text = transcript_cache.get(key)
+    if text is None:
+        metrics.inc("transcript_cache_misses_total", key=key_type)
+    else:
+        metrics.inc("transcript_cache_hits_total", key=key_type)
+    return text
 
-def transcribe_audio(file_path):
-    result = whisper_model.transcribe(file_path, task="translate")
+def cache_transcript(keys, text):
+    for key in keys:
+        transcript_cache.set(key, text, expire=TRANSCRIPT_CACHE_TTL)
+
+def transcribe_audio(data):
+    result = transcriber.transcribe(data)
     logging.info(f"✅ Transcription result: {result['text']}")
-    return result['text']
+    return result
 
 def handle_voice_message(message):
     media_id = message["audio"]["id"]
-    media_url = get_media_url(media_id)
+    timings = {}
+
+    media_key = f"media:{media_id}"
+    text = get_cached_transcript(media_key, "media_id")
+    if text is not None:
+        logging.info(f"♻️ Reusing transcript of {media_id}")
+        return text
+
+    started = time.perf_counter()
+    try:
+        media_url = get_media_url(media_id)
+    except (requests.RequestException, ValueError) as e:
+        logging.error(f"❌ Failed to get media URL for {media_id}: {e}")
+        return None
+    timings["fetch_url"] = time.perf_counter() - started
     if not media_url:
         logging.error("❌ Failed to get media URL")
         return None
 
-    file_path = download_audio(media_url, media_id)
-    return transcribe_audio(file_path)
\ No newline at end of file
+    started = time.perf_counter()
+    try:
+        data = download_audio(media_url)
+    except (requests.RequestException, AudioTooLarge) as e:
+        logging.error(f"❌ Failed to download audio {media_id}: {e}")
+        return None
+    timings["download"] = time.perf_counter() - started
+
+    # Same audio under a different media ID, e.g. a forwarded voice note
+    content_key = "sha256:" + hashlib.sha256(data).hexdigest()
+    text = get_cached_transcript(content_key, "content")
+    if text is not None:
+        logging.info(f"♻️ Reusing transcript of identical audio for {media_id}")
+        cache_transcript([media_key], text)
+        return text
+
+    try:
+        result = transcribe_audio(data)
+    except TranscriberBusy as e:
+        logging.error(f"🚦 Transcription queue full: {e}")
+        return None
+    except FuturesTimeout:
+        metrics.inc("transcription_failures_total", reason="timeout")
+        logging.error(f"⏰ Transcription of {media_id} timed out")
+        return None
+    except BrokenProcessPool as e:
+        metrics.inc("transcription_failures_total", reason="worker_died")
+        logging.error(f"💥 Transcription worker died on {media_id}: {e}")
+        return None
+    except RuntimeError as e:
+        # e.g. ffmpeg could not decode the audio
+        metrics.inc("transcription_failures_total", reason="decode")
+        logging.error(f"❌ Failed to transcribe {media_id}: {e}")
+        return None
+    timings.update(result["timings"])
+    cache_transcript([media_key, content_key], result["text"])
+
+    for stage, seconds in timings.items():
+        metrics.observe("voice_stage_seconds", seconds, stage=stage)
+    logging.info(
+        f"⏱️ Voice {media_id}: " + ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in timings.items())
+    )
+    return result["text"]
@@ -1,16 +1,11 @@
 import logging
-from flask import current_app, jsonify
 import json
-import requests
-from app.services.openai_service import generate_response
+import time
+from app.services.openai_service import generate_response, maintain_context, get_user_timezone, record_local_exchange
+from app.services.intent_router import intent_router
+from app.services.outbound import send_whatsapp_payload, INTERACTIVE
 import re
 
-def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
-
-
 def get_text_message_input(recipient, text):
     return json.dumps(
         {
@@ -25,30 +20,13 @@ def get_text_message_input(recipient, text):
 
 
 def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-
-    try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-    except requests.Timeout:
-        logging.error("Timeout occurred while sending message")
-        return jsonify({"status": "error", "message": "Request timed out"}), 408
-    except (
-        requests.RequestException
-    ) as e:  # This will catch any general request exception
-        logging.error(f"Request failed due to: {e}")
-        return jsonify({"status": "error", "message": "Failed to send message"}), 500
-    else:
-        # Process the response as normal
-        log_http_response(response)
-        return response
+    """
+    Queue a reply on the outbound send queue, ahead of any scheduled reminders.
+    Returns a Future with the delivery outcome; failures end up in the dead-letter store.
+    """
+    future = send_whatsapp_payload(json.loads(data), priority=INTERACTIVE)
+    future.add_done_callback(lambda f: logging.info(f"📤 Reply delivery: {f.result()}"))
+    return future
 
 
 def process_text_for_whatsapp(text):
@@ -69,70 +47,68 @@ def process_text_for_whatsapp(text):
     return whatsapp_style_text
 
 
-"""def process_whatsapp_message(body):
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
-
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-    user_input = message["text"]["body"]
-
-    # Log user message
-    log_time()
-    log_user_input(user_input)
-
-    # Classify user intent using LLM
-    task = classify_intent(data_status=False)
-    print(task)
-    task = json.loads(task)
-    print(type(task))
-
-    if task["type"]:
-        if "fetching_pending_scheduled_tasks" in task["type"]:
-            log_time()
-            log_bot_response(task["message"])
-            send_message(get_text_message_input(current_app.config["RECIPIENT_WAID"], task["message"]))
-            task = classify_intent(data_status=True)
-            task = json.loads(task)
-            log_time()
-            log_bot_response(task["message"])
-            send_message(get_text_message_input(current_app.config["RECIPIENT_WAID"], task["message"]))
-        else:
-            print("scheduling job ...")
-            unique_id = 10
-            schedule_job(current_app.config["RECIPIENT_WAID"], task, unique_id)
-            log_time()
-            log_bot_response("Bot: I have successfully scheduled your reminder. Can I do anything else for you?")
-            send_message(get_text_message_input(current_app.config["RECIPIENT_WAID"], "I have successfully scheduled your reminder\nCan I do anything else for you?"))
-            print("scheduled job")                
-            unique_id = unique_id + 10
+def process_user_messages(wa_id, name, message_bodies):
+    """
+    Answer one or more text messages from the same user with a single assistant turn.
+    """
+    message_body = "\n".join(message_bodies)
+
+    # Simple task queries are answered from the task store without an assistant run
+    local_reply = intent_router.route(wa_id, message_body, get_user_timezone(wa_id))
+    if local_reply is not None:
+        response = local_reply
     else:
-        log_time()
-        log_bot_response(task["message"])
-        send_message(get_text_message_input(current_app.config["RECIPIENT_WAID"], task["message"]))
-"""
-def process_whatsapp_message(body):
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
-
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-    message_body = message["text"]["body"]
-
-    # OpenAI Integration
-    response = generate_response(message_body, wa_id, name)
+        # OpenAI Integration
+        started = time.perf_counter()
+        response = generate_response(message_body, wa_id, name)
+        intent_router.observe_assistant_latency(time.perf_counter() - started)
     response = process_text_for_whatsapp(response)
     data = get_text_message_input(wa_id, response)
     send_message(data)
 
+    # After the reply is queued: keep the thread in step with locally answered
+    # messages, and roll a long conversation into a fresh thread. The reply has
+    # gone out, so a failure here must not fail the message.
+    try:
+        if local_reply is not None:
+            record_local_exchange(wa_id, message_body, local_reply)
+        maintain_context(wa_id)
+    except Exception:
+        logging.exception(f"❌ Context maintenance failed for {wa_id}")
+
+
+def iter_webhook_values(body):
+    """Yield the ``value`` of every change in every entry of a webhook payload."""
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value")
+            if value:
+                yield value
 
-def is_valid_whatsapp_message(body):
+
+def group_webhook_events(body):
     """
-    Check if the incoming webhook event has a valid WhatsApp message structure.
+    Collect every message and status in a (possibly batched) webhook payload.
+
+    Returns ``(users, statuses)`` where ``users`` maps each sender's wa_id to
+    ``{"name": ..., "messages": [...]}`` in arrival order.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    )
+    users = {}
+    statuses = []
+
+    for value in iter_webhook_values(body):
+        names = {
+            contact.get("wa_id"): contact.get("profile", {}).get("name", "")
+            for contact in value.get("contacts") or []
+        }
+        statuses.extend(value.get("statuses") or [])
+
+        for message in value.get("messages") or []:
+            wa_id = message.get("from") or next(iter(names), None)
+            if not wa_id:
+                continue
+            user = users.setdefault(wa_id, {"name": names.get(wa_id, ""), "messages": []})
+            user["messages"].append(message)
+
+    return users, statuses
+
@@ -3,50 +3,147 @@ import json
 from flask import Blueprint, request, jsonify, current_app
 from .decorators.security import signature_required
 from .utils.whatsapp_utils import (
-    process_whatsapp_message,
-    is_valid_whatsapp_message,
+    process_user_messages,
+    group_webhook_events,
+    get_text_message_input,
+    send_message,
 )
 from .utils.voice_handler import handle_voice_message
+from .utils import metrics
 
 webhook_blueprint = Blueprint("webhook", __name__)
 
+# Sent when none of a user's queued messages could be turned into text
+UNPROCESSABLE_REPLY = "Sorry, I couldn't process your message. Could you send it again as text?"
+# Sent when a queued batch failed after Meta was already acknowledged (async mode)
+FAILURE_REPLY = "Sorry, something went wrong on my side and I couldn't answer your message. Please try again."
+
+
+def message_to_text(message):
+    """
+    Return the text of an incoming message, transcribing voice notes.
+    Returns None when the message could not be turned into text.
+    """
+    msg_type = message.get("type")
+    logging.info(f"📥 Received message type: {msg_type}")
+
+    if msg_type == "audio":
+        transcribed_text = handle_voice_message(message)
+        if not transcribed_text:
+            logging.error("❌ Voice transcription failed")
+            return None
+        logging.info(f"🔊 Voice message transcribed as: {transcribed_text}")
+        return transcribed_text
+
+    text = message.get("text", {}).get("body")
+    if not text:
+        logging.warning(f"⚠️ Unsupported message type: {msg_type}")
+    return text
+
+
+def process_user_batch(wa_id, items):
+    """
+    Dispatcher handler: turn every queued message of one user into a single assistant turn.
+    A message that fails to convert is logged and skipped so the rest are still answered;
+    if none converts, the user gets a short "couldn't process" reply instead.
+    """
+    dedup = current_app.extensions["dedup"]
+    message_ids = [item["message"]["id"] for item in items if item["message"].get("id")]
+
+    texts = []
+    for item in items:
+        try:
+            text = message_to_text(item["message"])
+        except Exception:
+            metrics.inc("message_conversion_errors_total", type=item["message"].get("type"))
+            logging.exception(f"❌ Could not process message {item['message'].get('id')} from {wa_id}")
+            continue
+        if text:
+            texts.append(text)
 
-def handle_message():
-    body = request.get_json()
+    try:
+        if texts:
+            process_user_messages(wa_id, items[-1]["name"], texts)
+        else:
+            send_message(get_text_message_input(wa_id, UNPROCESSABLE_REPLY))
+    except Exception:
+        # In sync mode Meta's redelivery tries again; in async mode the user is told
+        for message_id in message_ids:
+            dedup.release(message_id)
+        raise
 
-    # Handle WhatsApp status events (e.g., delivered, read)
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("📬 Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
+    for message_id in message_ids:
+        dedup.complete(message_id)
+    return True
+
+
+def notify_batch_failure(wa_id, items):
+    """Dispatcher failure hook: tell the user their queued messages went unanswered."""
+    metrics.inc("failure_replies_total")
+    send_message(get_text_message_input(wa_id, FAILURE_REPLY))
 
-    try:
-        if is_valid_whatsapp_message(body):
-            message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-            msg_type = message.get("type")
-            logging.info(f"📥 Received message type: {msg_type}")
 
-            if msg_type == "audio":
-                transcribed_text = handle_voice_message(message)
-                if not transcribed_text:
-                    return jsonify({"status": "error", "message": "Voice transcription failed"}), 500
+def handle_message():
+    body = request.get_json()
 
-                # Convert it to text message for downstream processing
-                message["type"] = "text"
-                message["text"] = {"body": transcribed_text}
-                logging.info(f"🔊 Voice message transcribed as: {transcribed_text}")
+    try:
+        users, statuses = group_webhook_events(body) if body.get("object") else ({}, [])
 
-            process_whatsapp_message(body)
-            return jsonify({"status": "ok"}), 200
+        # Handle WhatsApp status events (e.g., delivered, read)
+        if statuses:
+            logging.info(f"📬 Received {len(statuses)} WhatsApp status update(s).")
 
-        else:
+        if not users:
+            if statuses:
+                return jsonify({"status": "ok"}), 200
             logging.warning("❌ Not a valid WhatsApp API event")
             return jsonify({"status": "error", "message": "Not a WhatsApp API event"}), 404
 
+        dispatcher = current_app.extensions["user_dispatcher"]
+        dedup = current_app.extensions["dedup"]
+        fan_out = {"messages": 0, "duplicates": 0, "users": 0, "statuses": len(statuses)}
+        busy = failed = False
+
+        for wa_id, user in users.items():
+            items = []
+            for message in user["messages"]:
+                fan_out["messages"] += 1
+                # Redelivered message that is already done or still being worked on
+                message_id = message.get("id")
+                if message_id:
+                    state = dedup.claim(message_id)
+                    if state is not None:
+                        logging.info(f"🔁 Skipping redelivered message {message_id} ({state})")
+                        fan_out["duplicates"] += 1
+                        continue
+                items.append({"name": user["name"], "message": message})
+
+            if not items:
+                continue
+            fan_out["users"] += 1
+
+            if current_app.config["WEBHOOK_MODE"] == "async":
+                # Acknowledge right away; a worker picks the burst up from the user's lane
+                if not dispatcher.dispatch(wa_id, items):
+                    for item in items:
+                        if item["message"].get("id"):
+                            dedup.release(item["message"]["id"])
+                    busy = True
+            elif not dispatcher.run_inline(wa_id, items):
+                failed = True
+
+        for key, count in fan_out.items():
+            metrics.observe("webhook_payload_fan_out", count, buckets=(0, 1, 2, 5, 10, 20, 50, 100), kind=key)
+        logging.info(f"📦 Webhook payload fan-out: {fan_out}")
+
+        if busy:
+            # Accepted messages are deduplicated when Meta redelivers the payload
+            logging.warning("🚦 Webhook queue is full, asking Meta to retry later")
+            return jsonify({"status": "error", "message": "Server busy"}), 503
+        if failed:
+            return jsonify({"status": "error", "message": "Failed to process message"}), 500
+        return jsonify({"status": "ok"}), 200
+
     except json.JSONDecodeError:
         logging.error("❌ Failed to decode JSON")
         return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
@@ -80,4 +177,9 @@ def webhook_get():
 @webhook_blueprint.route("/webhook", methods=["POST"])
 @signature_required
 def webhook_post():
-    return handle_message()
\ No newline at end of file
+    return handle_message()
+
+
+@webhook_blueprint.route("/metrics", methods=["GET"])
+def metrics_get():
+    return jsonify(metrics.snapshot()), 200
@@ -3,11 +3,10 @@ import logging
 from app import create_app
 
 
-app = create_app()
+# Processes started by multiprocessing (the transcription pool) re-import this
+# module as __mp_main__; only the server process itself builds the app
+app = create_app() if __name__ != "__mp_main__" else None
 
 if __name__ == "__main__":
     logging.info("Flask app started")
     app.run(host="0.0.0.0", port=8000)
-
-
-
@@ -0,0 +1,54 @@
+"""
+Benchmark: cost of recording a fired job's status as the number of users grows.
+
+For each user count it fills a scratch task store with one pending task per
+user and times scheduler.job_listener for a job owned by the last user. The
+listener does a single keyed update, so the cost should stay flat.
+
+    python scripts/bench_job_listener.py --sizes 10 100 1000 10000 100000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_job_listener_"))
+    from apscheduler.events import EVENT_JOB_EXECUTED
+    from app.services import scheduler
+    from app.services.task_store import task_store
+
+    created = 0
+    print(f"{'users':>8} {'median (ms)':>12} {'p99 (ms)':>10}")
+    for size in sorted(args.sizes):
+        with task_store.db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks (job_id, sender_id, task, type, event_time, event_ts, status, updated_at) "
+                "VALUES (?, ?, 'bench', 'whatsapp', '2030-01-01T09:00:00+05:30', 1893468600, 'pending', 0)",
+                [(f"bench-{i}", f"bench{i:07d}") for i in range(created, size)],
+            )
+        created = max(created, size)
+
+        event = SimpleNamespace(job_id=f"bench-{size - 1}", jobstore="default", code=EVENT_JOB_EXECUTED, exception=None)
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            scheduler.job_listener(event)
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        print(f"{size:>8} {statistics.median(samples):>12.3f} {samples[int(len(samples) * 0.99) - 1]:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark: firing lateness when thousands of reminders are due at the same instant.
+
+Schedules --jobs jobs (split across channels by --mix) all due --lead seconds
+from now on an in-memory scheduler. Stub notifiers sleep for a per-channel
+latency instead of doing network I/O. Each configuration is reported with the
+p50/p99/max lateness of job start versus the due time, the number of misfires
+and how long the burst took to drain:
+
+  shared       one 10-thread pool for everything (the old setup)
+  per-channel  the SCHEDULER_*_WORKERS pools from app/services/scheduler.py
+  +dispatch    per-channel pools plus --dispatch-rate spreading (SCHEDULER_DISPATCH_RATE,
+               off by default in the app)
+
+    python scripts/bench_scheduler_burst.py --jobs 3000 --mix whatsapp=0.7,email=0.2,call=0.1
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+LATENCY = {"whatsapp": 0.05, "email": 0.3, "call": 0.5}
+
+
+def run(label, executors, jobs, lead, misfire_grace_time, dispatch_rate):
+    from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED
+    from apscheduler.jobstores.memory import MemoryJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from app.services.scheduler import dispatch_delay
+
+    lateness = []
+    finished = {"done": 0, "missed": 0}
+    lock = threading.Lock()
+    all_done = threading.Event()
+
+    def stub(channel, due_ts):
+        lateness.append(time.time() - due_ts)
+        time.sleep(LATENCY[channel])
+
+    def listener(event):
+        with lock:
+            finished["missed" if event.code == EVENT_JOB_MISSED else "done"] += 1
+            if finished["done"] + finished["missed"] == len(jobs):
+                all_done.set()
+
+    sched = BackgroundScheduler(
+        jobstores={"default": MemoryJobStore()},
+        executors=executors,
+        job_defaults={"misfire_grace_time": misfire_grace_time},
+    )
+    sched.add_listener(listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    sched.start(paused=True)
+
+    due = datetime.now(timezone.utc) + timedelta(seconds=lead)
+    for i, channel in enumerate(jobs):
+        delay = dispatch_delay(i, rate=dispatch_rate)
+        sched.add_job(
+            stub, "date", run_date=due + timedelta(seconds=delay), args=[channel, due.timestamp()],
+            id=f"{label}-{i}", executor=channel if channel in executors else "default",
+        )
+    sched.resume()
+
+    all_done.wait()
+    drained = time.time() - due.timestamp()
+    sched.shutdown(wait=True)
+
+    lateness.sort()
+    p99 = lateness[max(int(len(lateness) * 0.99) - 1, 0)] if lateness else float("nan")
+    print(f"{label:<12} {statistics.median(lateness) if lateness else float('nan'):>9.3f} {p99:>9.3f} "
+          f"{lateness[-1] if lateness else float('nan'):>9.3f} {finished['missed']:>8} {drained:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=3000)
+    parser.add_argument("--mix", default="whatsapp=0.7,email=0.2,call=0.1")
+    parser.add_argument("--lead", type=float, default=3.0, help="seconds from now until the jobs are due")
+    parser.add_argument("--misfire-grace-time", type=int, default=None)
+    parser.add_argument("--dispatch-rate", type=float, default=None,
+                        help="jobs per second for +dispatch (default SCHEDULER_DISPATCH_RATE, or 50 when that is off)")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_scheduler_burst_"))
+    from app.services import scheduler
+
+    mix = {channel: float(share) for channel, share in (part.split("=") for part in args.mix.split(","))}
+    jobs = []
+    for channel, share in mix.items():
+        jobs += [channel] * round(args.jobs * share)
+    # Interleave channels the way independent users' reminders would arrive
+    random.Random(0).shuffle(jobs)
+    grace = args.misfire_grace_time if args.misfire_grace_time is not None else scheduler.SCHEDULER_MISFIRE_GRACE_TIME
+    dispatch_rate = args.dispatch_rate if args.dispatch_rate is not None else scheduler.SCHEDULER_DISPATCH_RATE or 50
+
+    print(f"{len(jobs)} jobs {mix}, stub latency {LATENCY}, misfire grace {grace}s")
+    print(f"{'config':<12} {'p50 (s)':>9} {'p99 (s)':>9} {'max (s)':>9} {'misfired':>8} {'drain (s)':>10}")
+    run("shared", scheduler.build_executors({"default": 10}), jobs, args.lead, grace, 0)
+    run("per-channel", scheduler.build_executors(), jobs, args.lead, grace, 0)
+    run("+dispatch", scheduler.build_executors(), jobs, args.lead, grace, dispatch_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Check that the deployed assistant (OPENAI_ASSISTANT_ID) has the same system
+prompt and tool schemas as app/services/openai_service.py, and that every
+deployed tool has an implementation in TOOL_REGISTRY. Exits 1 on drift.
+--sync pushes the local prompt and tools first (the app does this at startup).
+
+    python scripts/check_assistant.py --sync
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.openai_service import sync_assistant, OPENAI_ASSISTANT_ID
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync", action="store_true", help="update the assistant when it differs")
+    args = parser.parse_args()
+
+    drift = sync_assistant(update=args.sync)
+    print(f"assistant {OPENAI_ASSISTANT_ID}: {'in sync' if not drift else 'out of sync'}")
+    for line in drift:
+        print(f"  ! {line}")
+    sys.exit(1 if drift else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Run task store compaction once and print the report (the scheduler leader
+also runs it every TASK_COMPACT_INTERVAL_HOURS).
+
+    python scripts/compact_tasks.py --retention-days 30 --archive-retention-days 365
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.task_store import task_store, TASK_RETENTION_DAYS, TASK_ARCHIVE_RETENTION_DAYS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--retention-days", type=float, default=TASK_RETENTION_DAYS)
+    parser.add_argument("--archive-retention-days", type=float, default=TASK_ARCHIVE_RETENTION_DAYS,
+                        help="0 keeps archived tasks forever")
+    args = parser.parse_args()
+
+    report = task_store.compact(args.retention_days, args.archive_retention_days)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Smoke test for the reminder notifiers without real credentials.
+
+Starts a local SMTP server (needs `pip install aiosmtpd`), points the notifier
+at it, swaps in a stub Twilio client, then fires --emails email reminders and
+--calls call reminders concurrently, the way a burst of due jobs would. Prints
+the delivery results and how many SMTP connections were opened for them.
+
+    python scripts/notifier_smoke.py --emails 200 --calls 20
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+class StubCalls:
+    def __init__(self):
+        self.created = []
+
+    def create(self, to, from_, twiml):
+        self.created.append(to)
+        return SimpleNamespace(sid=f"CA-stub-{len(self.created)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--threads", type=int, default=10, help="concurrent reminder jobs, like the scheduler pool")
+    args = parser.parse_args()
+
+    from aiosmtpd.controller import Controller
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+
+    os.environ.update({
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(args.port),
+        "SMTP_SSL": "false",
+        "SMTP_EMAIL": "reminders@example.com",
+        "SMTP_PASSWORD": "",
+    })
+    from app.services import notifier
+
+    stub_calls = StubCalls()
+    notifier.set_twilio_client(SimpleNamespace(calls=stub_calls))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        emails = [pool.submit(notifier.send_email, f"user{i}@example.com", "Reminder", "Hello") for i in range(args.emails)]
+        calls = [pool.submit(notifier.make_voice_call, f"+91 98765 {i:05d}", "Hello") for i in range(args.calls)]
+        results = [f.result() for f in emails + calls]
+    elapsed = time.perf_counter() - started
+    controller.stop()
+
+    failed = [r for r in results if not r["ok"]]
+    print(f"{len(results)} reminders in {elapsed:.2f}s")
+    print(f"  emails received by server  {handler.received}/{args.emails}")
+    print(f"  SMTP connections opened    {notifier.get_smtp_sender().connections_opened}")
+    print(f"  calls placed (stub)        {len(stub_calls.created)}/{args.calls}")
+    for result in failed[:10]:
+        print(f"  ! {result}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
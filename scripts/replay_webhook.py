@@ -0,0 +1,93 @@
+"""
+Replay harness for webhook deduplication.
+
+Fires the same signed WhatsApp message payload at a running app several times
+(first concurrently, then one by one, as Meta does when it redelivers) and
+prints how the app answered plus the dedup counters from GET /metrics.
+
+    python scripts/replay_webhook.py --url http://localhost:8000 --wa-id 919876543210 --count 5
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from dotenv import load_dotenv
+
+
+def build_payload(wa_id, text, message_id):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "replay",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"wa_id": wa_id, "profile": {"name": "Replay"}}],
+                    "messages": [{
+                        "from": wa_id,
+                        "id": message_id,
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": text},
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+def post_signed(url, body, app_secret):
+    raw = json.dumps(body)
+    signature = hmac.new(app_secret.encode("latin-1"), raw.encode("utf-8"), hashlib.sha256).hexdigest()
+    response = requests.post(
+        f"{url}/webhook",
+        data=raw,
+        headers={"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={signature}"},
+        timeout=30,
+    )
+    return response.status_code
+
+
+def dedup_counters(url):
+    counters = requests.get(f"{url}/metrics", timeout=10).json()["counters"]
+    return {k: v for k, v in counters.items() if k.startswith("webhook_duplicates_total")}
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--wa-id", required=True)
+    parser.add_argument("--text", default="What are my pending reminders?")
+    parser.add_argument("--count", type=int, default=5, help="deliveries per phase")
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds between sequential redeliveries")
+    args = parser.parse_args()
+
+    app_secret = os.getenv("APP_SECRET")
+    body = build_payload(args.wa_id, args.text, f"wamid.replay.{uuid.uuid4().hex}")
+    before = dedup_counters(args.url)
+
+    with ThreadPoolExecutor(max_workers=args.count) as pool:
+        burst = list(pool.map(lambda _: post_signed(args.url, body, app_secret), range(args.count)))
+    print(f"Concurrent deliveries: {burst}")
+
+    sequential = []
+    for _ in range(args.count):
+        time.sleep(args.delay)
+        sequential.append(post_signed(args.url, body, app_secret))
+    print(f"Sequential redeliveries: {sequential}")
+
+    after = dedup_counters(args.url)
+    skipped = sum(after.values()) - sum(before.values())
+    print(f"Duplicates skipped: {skipped} of {2 * args.count - 1} redeliveries ({after})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Smoke test for the assistant run engine against a local fake Assistants API.
+
+Starts a small HTTP server that plays the run lifecycle the way OpenAI does
+(queued -> in_progress -> requires_action -> tool outputs -> in_progress ->
+completed, with --queue-delay/--think-delay seconds in each server-side phase)
+for both the streaming (SSE) and the plain endpoints. Then drives
+app.services.run_engine.execute_run through it in "stream" and "poll" mode
+with a tool handler that takes --tool-delay seconds, and prints each run's
+status, reply, per-phase timings and how many requests it cost.
+
+    python scripts/run_engine_smoke.py --runs 3 --tool-calls 2
+
+With --serve it only runs the fake server, e.g. to point the OpenAI SDK at it
+with OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+REPLY = "Done: your reminders are scheduled."
+
+
+class FakeRun:
+    def __init__(self, thread_id, assistant_id, tool_calls):
+        self.id = f"run_{uuid.uuid4().hex[:12]}"
+        self.thread_id = thread_id
+        self.assistant_id = assistant_id
+        self.created = time.monotonic()
+        self.submitted = None
+        self.tool_calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": "get_pending_tasks", "arguments": "{}"},
+            }
+            for _ in range(tool_calls)
+        ]
+
+    def status(self, queue_delay, think_delay):
+        if self.submitted is not None:
+            return "completed" if time.monotonic() - self.submitted >= think_delay else "in_progress"
+        elapsed = time.monotonic() - self.created
+        if elapsed < queue_delay:
+            return "queued"
+        if elapsed < queue_delay + think_delay:
+            return "in_progress"
+        return "requires_action" if self.tool_calls else "completed"
+
+    def to_dict(self, status):
+        required_action = None
+        if status == "requires_action":
+            required_action = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": self.tool_calls}}
+        return {
+            "id": self.id,
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": self.thread_id,
+            "assistant_id": self.assistant_id,
+            "status": status,
+            "required_action": required_action,
+            "model": "fake",
+            "instructions": "",
+            "tools": [],
+        }
+
+    def message(self):
+        return {
+            "id": f"msg_{self.id}",
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": self.thread_id,
+            "run_id": self.id,
+            "assistant_id": self.assistant_id,
+            "role": "assistant",
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": REPLY, "annotations": []}}],
+            "attachments": [],
+            "metadata": {},
+        }
+
+
+class FakeAssistantsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue_delay, think_delay, tool_calls):
+        super().__init__(address, FakeAssistantsHandler)
+        self.queue_delay = queue_delay
+        self.think_delay = think_delay
+        self.tool_calls = tool_calls
+        self.runs = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class FakeAssistantsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    RUNS = re.compile(r"^/v1/threads/([^/]+)/runs$")
+    RUN = re.compile(r"^/v1/threads/([^/]+)/runs/([^/]+)$")
+    SUBMIT = re.compile(r"^/v1/threads/([^/]+)/runs/([^/]+)/submit_tool_outputs$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._count()
+        match = self.RUN.match(self.path)
+        run = self.server.runs.get(match.group(2)) if match else None
+        if run is None:
+            return self._json(404, {"error": {"message": f"No route or run for {self.path}"}})
+        self._json(200, run.to_dict(self._status(run)))
+
+    def do_POST(self):
+        self._count()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+
+        match = self.RUNS.match(self.path)
+        if match:
+            run = FakeRun(match.group(1), body.get("assistant_id"), self.server.tool_calls)
+            with self.server.lock:
+                self.server.runs[run.id] = run
+            if body.get("stream"):
+                return self._stream_until_action(run)
+            return self._json(200, run.to_dict(self._status(run)))
+
+        match = self.SUBMIT.match(self.path)
+        run = self.server.runs.get(match.group(2)) if match else None
+        if run is None:
+            return self._json(404, {"error": {"message": f"No route or run for {self.path}"}})
+        submitted = sorted(output["tool_call_id"] for output in body.get("tool_outputs", []))
+        if self._status(run) != "requires_action" or submitted != sorted(c["id"] for c in run.tool_calls):
+            return self._json(400, {"error": {"message": "Run is not waiting for these tool outputs"}})
+        run.submitted = time.monotonic()
+        if body.get("stream"):
+            return self._stream_until_done(run)
+        self._json(200, run.to_dict("queued"))
+
+    def _count(self):
+        with self.server.lock:
+            self.server.requests += 1
+
+    def _status(self, run):
+        return run.status(self.server.queue_delay, self.server.think_delay)
+
+    def _json(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _event(self, event, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode())
+        self.wfile.flush()
+
+    def _stream_until_action(self, run):
+        self._start_stream()
+        self._event("thread.run.created", run.to_dict("queued"))
+        self._event("thread.run.queued", run.to_dict("queued"))
+        time.sleep(self.server.queue_delay)
+        self._event("thread.run.in_progress", run.to_dict("in_progress"))
+        time.sleep(self.server.think_delay)
+        if run.tool_calls:
+            self._event("thread.run.requires_action", run.to_dict("requires_action"))
+            self._event("done", "[DONE]")
+        else:
+            self._finish_stream(run)
+
+    def _stream_until_done(self, run):
+        self._start_stream()
+        self._event("thread.run.queued", run.to_dict("queued"))
+        self._event("thread.run.in_progress", run.to_dict("in_progress"))
+        time.sleep(self.server.think_delay)
+        self._finish_stream(run)
+
+    def _finish_stream(self, run):
+        message = run.message()
+        self._event("thread.message.created", {**message, "status": "in_progress", "content": []})
+        self._event("thread.message.completed", message)
+        self._event("thread.run.completed", run.to_dict("completed"))
+        self._event("done", "[DONE]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--runs", type=int, default=3, help="runs per mode")
+    parser.add_argument("--tool-calls", type=int, default=2, help="tool calls in the requires_action step")
+    parser.add_argument("--queue-delay", type=float, default=0.1)
+    parser.add_argument("--think-delay", type=float, default=0.3)
+    parser.add_argument("--tool-delay", type=float, default=0.2)
+    parser.add_argument("--serve", action="store_true", help="only run the fake server")
+    args = parser.parse_args()
+
+    server = FakeAssistantsServer(("127.0.0.1", args.port), args.queue_delay, args.think_delay, args.tool_calls)
+    if args.serve:
+        print(f"Fake Assistants API on http://127.0.0.1:{args.port}/v1")
+        server.serve_forever()
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    from openai import OpenAI
+    from app.services.run_engine import execute_run
+
+    client = OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{args.port}/v1", max_retries=0)
+    handled = []
+
+    def handle_tool_calls(tool_calls):
+        time.sleep(args.tool_delay)
+        handled.append(len(tool_calls))
+        return [{"tool_call_id": call.id, "output": json.dumps({"tasks": []})} for call in tool_calls]
+
+    failed = False
+    for mode in ("stream", "poll"):
+        for i in range(args.runs):
+            server.requests = 0
+            handled.clear()
+            result = execute_run(client, f"thread_smoke_{i}", "asst_smoke", handle_tool_calls, mode=mode)
+            ok = result["status"] == "completed" and handled == ([args.tool_calls] if args.tool_calls else [])
+            if mode == "stream":
+                ok = ok and result["reply"] == REPLY
+            failed = failed or not ok
+            print(f"{mode:6} run {i}: {result['status']:9} requests={server.requests:<3} "
+                  f"reply={result['reply']!r} {'ok' if ok else 'FAILED'}")
+            print(f"         timings {result['timings']}")
+
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
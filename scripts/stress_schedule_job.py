@@ -0,0 +1,124 @@
+"""
+Stress test: concurrent schedule_job calls and status updates from several
+worker processes, all writing tasks for the same few users.
+
+Every process schedules --jobs reminders (one WhatsApp job each, due far in
+the future so nothing fires) and then marks each of its own jobs completed
+through scheduler.job_listener. Afterwards the script checks that:
+
+  - every job got a unique ID (task rows and job-store rows == jobs scheduled)
+  - no status update was lost (every task is "completed")
+
+    python scripts/stress_schedule_job.py --processes 8 --jobs 200 --users 3
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# A worker that dies breaks the barrier instead of leaving the others waiting forever
+BARRIER_TIMEOUT = 120
+
+
+def worker(index, workdir, jobs, users, barrier, errors):
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+    from apscheduler.events import EVENT_JOB_EXECUTED
+    from app.services import scheduler
+    from app.services.task_store import task_store
+    # Add jobs to the shared store without competing to fire them
+    scheduler.start_scheduler(elect_leader=False)
+
+    barrier.wait(timeout=BARRIER_TIMEOUT)
+    for i in range(jobs):
+        try:
+            scheduler.schedule_job(f"stress{i % users:03d}", {
+                "task": f"stress {index}-{i}",
+                "type": ["whatsapp"],
+                "time": "2099-01-01T09:00:00+05:30",
+                "reminder_message": "stress",
+            })
+        except Exception as e:
+            errors.put(f"worker {index} schedule #{i}: {e!r}")
+
+    barrier.wait(timeout=BARRIER_TIMEOUT)
+    rows = task_store.db.execute("SELECT job_id FROM tasks WHERE task LIKE ?", (f"stress {index}-%",)).fetchall()
+    for row in rows:
+        scheduler.job_listener(SimpleNamespace(
+            job_id=row["job_id"], jobstore="default", code=EVENT_JOB_EXECUTED, exception=None,
+        ))
+
+    scheduler.scheduler.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--jobs", type=int, default=200, help="jobs scheduled per process")
+    parser.add_argument("--users", type=int, default=3, help="distinct senders shared by all processes")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for all workers")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress_schedule_job_")
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.processes)
+    errors = ctx.Queue()
+
+    started = time.perf_counter()
+    procs = [
+        ctx.Process(target=worker, args=(i, workdir, args.jobs, args.users, barrier, errors))
+        for i in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+    deadline = time.monotonic() + args.timeout
+    for proc in procs:
+        proc.join(timeout=max(0.0, deadline - time.monotonic()))
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    for index, proc in enumerate(procs):
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+            failures.append(f"worker {index} did not finish within {args.timeout}s")
+        elif proc.exitcode != 0:
+            failures.append(f"worker {index} exited with code {proc.exitcode}")
+    if failures:
+        # A dead worker means the counts below would be meaningless (or the files missing)
+        print(f"❌ {len(failures)} worker(s) failed ({workdir})")
+        for failure in failures:
+            print(f"  ! {failure}")
+        sys.exit(1)
+
+    expected = args.processes * args.jobs
+    tasks = sqlite3.connect(os.path.join(workdir, "tasks.sqlite3"))
+    task_rows = tasks.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+    completed = tasks.execute("SELECT COUNT(*) FROM tasks WHERE status = 'completed'").fetchone()[0]
+    job_rows = sqlite3.connect(os.path.join(workdir, "jobs.sqlite3")).execute(
+        "SELECT COUNT(*) FROM apscheduler_jobs"
+    ).fetchone()[0]
+
+    while not errors.empty():
+        failures.append(errors.get())
+
+    print(f"{args.processes} processes x {args.jobs} jobs in {elapsed:.1f}s ({workdir})")
+    print(f"  scheduled  {expected}")
+    print(f"  task rows  {task_rows}")
+    print(f"  job rows   {job_rows}")
+    print(f"  completed  {completed}")
+    for failure in failures[:10]:
+        print(f"  ! {failure}")
+
+    ok = not failures and task_rows == job_rows == completed == expected
+    print("✅ no duplicate IDs, no lost updates" if ok else "❌ duplicate IDs or lost updates")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,68 @@
-from flask import Flask, render_template, request
-import pandas as pd
-from app.utils.pending_task import get_tasks
-import os
+from flask import Flask, jsonify, render_template, request
+from app.services.task_store import task_store, to_timestamp, SORT_COLUMNS
 
 app = Flask(__name__)
 
-# Discover available WhatsApp IDs (status_cache/<wa_id>/)
+MAX_PAGE_SIZE = 200
+
+# Cached list of WhatsApp IDs, reloaded only when a new sender has been added
+_wa_ids_cache = {"version": None, "wa_ids": []}
+
 def list_wa_ids():
-    base_path = "status_cache"
-    if not os.path.exists(base_path):
-        return []
-    return [d for d in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, d))]
+    version = task_store.senders_version()
+    if version != _wa_ids_cache["version"]:
+        _wa_ids_cache["wa_ids"] = task_store.list_senders()
+        _wa_ids_cache["version"] = version
+    return _wa_ids_cache["wa_ids"]
 
 @app.route('/')
 def dashboard():
-    wa_id = request.args.get("wa_id")
-    wa_ids = list_wa_ids()
-
-    if wa_id:
-        try:
-            data = get_tasks(wa_id)
-            df = pd.DataFrame.from_dict(data, orient='index')
-            df.index.name = 'ID'
-            df = df.reset_index()
-            table = df.to_html(classes="table table-striped table-bordered", index=False)
-        except Exception as e:
-            table = f"<p>Error loading data for {wa_id}: {e}</p>"
-    else:
-        table = "<p>Please select a WhatsApp ID from the dropdown.</p>"
-
-    return render_template("dashboard.html", table=table, wa_ids=wa_ids, selected_wa_id=wa_id)
+    # The table itself is fetched page by page from /api/tasks
+    return render_template(
+        "dashboard.html",
+        wa_ids=list_wa_ids(),
+        selected_wa_id=request.args.get("wa_id"),
+        sort_columns=sorted(SORT_COLUMNS),
+    )
+
+@app.route('/api/users')
+def api_users():
+    return jsonify({"users": list_wa_ids()})
+
+@app.route('/api/tasks')
+def api_tasks():
+    args = request.args
+    wa_id = args.get("wa_id")
+    if not wa_id:
+        return jsonify({"error": "wa_id is required"}), 400
+
+    try:
+        limit = min(max(int(args.get("limit", 50)), 1), MAX_PAGE_SIZE)
+        page = task_store.query_tasks(
+            wa_id,
+            status=args.get("status") or None,
+            task_type=args.get("type") or None,
+            since=to_timestamp(args.get("from")),
+            until=to_timestamp(args.get("to")),
+            sort=args.get("sort", "event_time"),
+            descending=args.get("order", "asc") == "desc",
+            limit=limit,
+            cursor=args.get("cursor") or None,
+            archived=args.get("archived") == "1",
+        )
+    except (ValueError, OverflowError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(page)
+
+@app.route('/api/tasks/<job_id>/occurrences')
+def api_occurrences(job_id):
+    # Run history of a recurring task
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"occurrences": task_store.get_occurrences(job_id, limit)})
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)